@@ -36,6 +36,45 @@ class Config:
     # LLM 請求超時設定（秒）
     LLM_TIMEOUT = int(os.getenv("LLM_TIMEOUT", "60"))
 
+    # LLM 連線池大小（同時可保持的連線數，建議 >= PARSE_WORKERS）
+    LLM_POOL_SIZE = int(os.getenv("LLM_POOL_SIZE", "10"))
+
+    # 是否保持 HTTP 連線（keep-alive），避免每次呼叫重新握手
+    LLM_KEEP_ALIVE = os.getenv("LLM_KEEP_ALIVE", "true").lower() == "true"
+
+    # 記住可用的 endpoint（/generate 或 /chat）多久後重新協商（秒）
+    LLM_ENDPOINT_REVALIDATE_SECONDS = int(os.getenv("LLM_ENDPOINT_REVALIDATE_SECONDS", "600"))
+
+    # LLM 呼叫失敗（超時、連線失敗、5xx）時最多重試幾次（所有嘗試共用 LLM_TIMEOUT）
+    LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+
+    # 重試的退避基準（秒），第 n 次重試前隨機等待 0 ~ 基準 × 2^n 秒
+    LLM_RETRY_BACKOFF = float(os.getenv("LLM_RETRY_BACKOFF", "0.5"))
+
+    # 斷路器：連續失敗幾次後暫停呼叫 LLM（0 表示停用）
+    LLM_BREAKER_THRESHOLD = int(os.getenv("LLM_BREAKER_THRESHOLD", "5"))
+
+    # 斷路器：暫停多久後再試探（秒）
+    LLM_BREAKER_COOLDOWN = int(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+
+    # 是否開啟對沖請求：超過近期 p95 延遲還沒回應就再送一份，取先回來的結果
+    LLM_HEDGE = os.getenv("LLM_HEDGE", "false").lower() == "true"
+
+    # 至少累積幾筆延遲樣本才開始對沖
+    LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+
+    # 是否以串流模式呼叫 LLM（CLI / 網頁即時顯示 LLM 輸出與首個 token 時間）
+    LLM_STREAM = os.getenv("LLM_STREAM", "false").lower() == "true"
+
+    # LLM 回應快取的最大筆數（0 表示不快取）
+    LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", "256"))
+
+    # LLM 回應快取的有效時間（秒，0 表示不過期）
+    LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", "3600"))
+
+    # LLM 回應快取的磁碟檔案（SQLite，重啟後仍有效；留空表示只存在記憶體）
+    LLM_CACHE_FILE = os.getenv("LLM_CACHE_FILE", "")
+
     # ========== Agent 配置 ==========
     # 是否顯示 debug 訊息
     DEBUG_MODE = os.getenv("DEBUG_MODE", "true").lower() == "true"
@@ -43,6 +82,24 @@ class Config:
     # 人數匹配容差（允許推薦的人數差異）
     PEOPLE_TOLERANCE = int(os.getenv("PEOPLE_TOLERANCE", "1"))
 
+    # 是否先用規則提取意圖（「2」「3個人」「炸雞」「好了」這類輸入不呼叫 LLM）
+    INTENT_RULES_ENABLED = os.getenv("INTENT_RULES_ENABLED", "true").lower() == "true"
+
+    # 意圖提取快取的最大筆數（所有對話共用，相同說法不再呼叫 LLM）
+    EXTRACTION_CACHE_SIZE = int(os.getenv("EXTRACTION_CACHE_SIZE", "1024"))
+
+    # 意圖提取 Prompt 只放最相似的幾個範例（0 表示送出完整的範例與同義詞表）
+    PROMPT_FEWSHOT_K = int(os.getenv("PROMPT_FEWSHOT_K", "6"))
+
+    # 意圖提取的結構化輸出："json"（JSON 模式）、"schema"（JSON Schema，Ollama 0.5+）或 "none"
+    EXTRACT_FORMAT = os.getenv("EXTRACT_FORMAT", "json").lower()
+
+    # 意圖提取的最大回應長度（回應只是一個小 JSON 物件）
+    EXTRACT_MAX_TOKENS = int(os.getenv("EXTRACT_MAX_TOKENS", "100"))
+
+    # 查詢結果每頁顯示幾張優惠券（輸入「更多」看下一頁；0 表示一次全部顯示）
+    RESULTS_PAGE_SIZE = int(os.getenv("RESULTS_PAGE_SIZE", "5"))
+
     # ========== 爬蟲配置 ==========
     # KFC 優惠券頁面 URL（未來使用）
     KFC_COUPON_URL = os.getenv("KFC_COUPON_URL", "https://www.kfcclub.com.tw/")
@@ -50,6 +107,24 @@ class Config:
     # 爬蟲請求超時（秒）
     SCRAPER_TIMEOUT = int(os.getenv("SCRAPER_TIMEOUT", "10"))
 
+    # 優惠券 LLM 解析的並行 worker 數（1 表示逐張解析）
+    PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", "4"))
+
+    # 每次 LLM 請求打包幾張優惠券一起解析（1 表示不打包）
+    PARSE_BATCH_SIZE = int(os.getenv("PARSE_BATCH_SIZE", "1"))
+
+    # 是否先用規則解析常見格式的優惠券（信心不足才呼叫 LLM）
+    RULE_PARSER_ENABLED = os.getenv("RULE_PARSER_ENABLED", "true").lower() == "true"
+
+    # 規則解析的最低信心分數（0.0-1.0）
+    RULE_PARSER_MIN_CONFIDENCE = float(os.getenv("RULE_PARSER_MIN_CONFIDENCE", "0.8"))
+
+    # 優惠券資料儲存方式："sqlite"（有索引的資料庫）或 "json"（data/coupons.json）
+    COUPON_STORE = os.getenv("COUPON_STORE", "sqlite").lower()
+
+    # 快取過期時先用舊資料啟動，並在背景更新（stale-while-revalidate）
+    STALE_WHILE_REVALIDATE = os.getenv("STALE_WHILE_REVALIDATE", "true").lower() == "true"
+
     # 優惠券快取檔案路徑
     COUPON_CACHE_FILE = os.getenv("COUPON_CACHE_FILE", "coupons_cache.json")
 
@@ -57,6 +132,15 @@ class Config:
     # 優惠券圖片儲存路徑
     COUPON_IMAGES_DIR = os.getenv("COUPON_IMAGES_DIR", "coupon_images")
 
+    # 更新優惠券時是否一併下載圖片到本機
+    DOWNLOAD_IMAGES = os.getenv("DOWNLOAD_IMAGES", "true").lower() == "true"
+
+    # 同時下載圖片的 worker 數
+    IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "8"))
+
+    # 縮圖最長邊（像素，需要 Pillow）
+    THUMBNAIL_SIZE = int(os.getenv("THUMBNAIL_SIZE", "320"))
+
     @classmethod
     def validate(cls):
         """
@@ -85,9 +169,14 @@ class Config:
         print(f"LLM API URL: {cls.OLLAMA_API_URL}")
         print(f"LLM Model: {cls.OLLAMA_MODEL}")
         print(f"LLM Timeout: {cls.LLM_TIMEOUT}秒")
+        print(f"LLM Cache: {cls.LLM_CACHE_SIZE} 筆，TTL {cls.LLM_CACHE_TTL}秒{f'（{cls.LLM_CACHE_FILE}）' if cls.LLM_CACHE_FILE else ''}")
         print(f"Debug Mode: {cls.DEBUG_MODE}")
         print(f"People Tolerance: ±{cls.PEOPLE_TOLERANCE}人")
+        print(f"Results Page Size: {cls.RESULTS_PAGE_SIZE or '全部'}")
         print(f"KFC URL: {cls.KFC_COUPON_URL}")
+        print(f"Parse Workers: {cls.PARSE_WORKERS}")
+        print(f"Parse Batch Size: {cls.PARSE_BATCH_SIZE}")
+        print(f"Coupon Store: {cls.COUPON_STORE}")
         print("=" * 60)
 
 
@@ -10,7 +10,12 @@ from typing import Any, Dict, List
 import streamlit as st
 
 from src.agent import KFCAgent
-from src.scraper import should_update_coupons, scrape_and_parse, load_coupons_from_cache
+from config.config import config
+from src.utils import get_llm_client
+from src.scraper import (
+    should_update_coupons, scrape_and_parse, load_coupons_from_cache,
+    catalog, refresh_catalog_in_background, get_local_image
+)
 
 
 # ---------- Page Config ----------
@@ -63,7 +68,15 @@ if not st.session_state.initialized:
     if "messages" not in st.session_state:
         st.session_state.messages = []
 
-    if need_update:
+    stale = load_coupons_from_cache() if need_update and config.STALE_WHILE_REVALIDATE else None
+
+    if stale:
+        # 先用舊資料開始對話，背景更新完成後再替換
+        coupons = stale
+        refresh_catalog_in_background()
+        need_update = False
+        reason = f"{reason}，背景更新中"
+    elif need_update:
         # AI 告知需要爬蟲
         init_msg = f"👋 歡迎使用！我發現{reason}，讓我先幫你抓取最新的優惠券資料..."
         st.session_state.messages.append({
@@ -140,6 +153,7 @@ if not st.session_state.initialized:
     st.session_state.agent = KFCAgent(coupons)
     st.session_state.coupons = coupons
     st.session_state.cache_reason = reason if not need_update else "資料是最新的"
+    st.session_state.catalog_version = catalog.version
     st.session_state.initialized = True
 
     # 顯示歡迎訊息和品項列表（加入 messages，會在後續統一渲染）
@@ -150,6 +164,16 @@ if not st.session_state.initialized:
     })
 
 
+# ---------- Background Refresh ----------
+# 背景更新完成：換上新的優惠券（保留目前的對話狀態）
+_version, _latest = catalog.get()
+if _version != st.session_state.catalog_version and _latest:
+    st.session_state.agent.update_coupons(_latest)
+    st.session_state.coupons = _latest
+    st.session_state.catalog_version = _version
+    st.session_state.cache_reason = "資料是最新的（背景更新完成）"
+
+
 # ---------- Sidebar Info ----------
 with st.sidebar:
     st.header("📊 系統資訊")
@@ -174,6 +198,7 @@ with st.sidebar:
     **提示：**
     - 可以分次輸入資訊
     - 不知道吃什麼？說「不知道」看菜單
+    - 結果太多？說「更多」看下一頁
     - 想重來？說「重來」
     """)
 
@@ -196,8 +221,10 @@ def render_coupon_card(coupon: Dict[str, Any]):
 
         # 圖片
         with cols[0]:
-            if coupon.get("img"):
-                st.image(coupon["img"], use_container_width=True)
+            # 優先使用本機快取的縮圖，沒有才連到 KFC 的圖片伺服器
+            image = get_local_image(coupon) or coupon.get("img")
+            if image:
+                st.image(image, use_container_width=True)
 
         # 資訊
         with cols[1]:
@@ -256,8 +283,9 @@ for msg in st.session_state.messages:
         # 如果有優惠券資料，渲染卡片
         if msg.get("coupons"):
             st.divider()
+            start = msg.get("coupon_start", 0)
             for i, coupon in enumerate(msg["coupons"], 1):
-                st.markdown(f"#### 推薦 {i}")
+                st.markdown(f"#### 推薦 {start + i}")
                 render_coupon_card(coupon)
                 if i < len(msg["coupons"]):
                     st.divider()
@@ -278,8 +306,25 @@ if user_input:
 
     # 處理 Agent 回應
     with st.chat_message("assistant"):
-        with st.spinner("思考中..."):
+        if config.LLM_STREAM:
+            # 串流模式：即時顯示 LLM 輸出，完成後顯示首個 token 時間
+            placeholder = st.empty()
+            streamed = []
+
+            def show_token(chunk):
+                streamed.append(chunk)
+                placeholder.code("".join(streamed), language="json")
+
+            st.session_state.agent.on_token = show_token
             response = st.session_state.agent.process(user_input)
+            placeholder.empty()
+
+            timing = get_llm_client().last_timing
+            if streamed and timing and timing.get("ttft") is not None:
+                st.caption(f"⚡ 首個 token {timing['ttft']:.2f}s，總計 {timing['total']:.2f}s")
+        else:
+            with st.spinner("思考中..."):
+                response = st.session_state.agent.process(user_input)
 
         # 解析回應
         text_msg, coupons = parse_agent_response(response)
@@ -288,19 +333,26 @@ if user_input:
         st.markdown(text_msg)
 
         # 如果有優惠券，渲染卡片
+        # 分頁：只渲染這一頁的卡片，編號接續前一頁
+        context = st.session_state.agent.context
+        coupon_start = context.get("page_cursor", 0) - len(coupons)
         if coupons:
             st.divider()
             for i, coupon in enumerate(coupons, 1):
-                st.markdown(f"#### 推薦 {i}")
+                st.markdown(f"#### 推薦 {coupon_start + i}")
                 render_coupon_card(coupon)
                 if i < len(coupons):
                     st.divider()
+            remaining = len(context.get("matches", [])) - context.get("page_cursor", 0)
+            if remaining > 0:
+                st.caption(f"還有 {remaining} 張，輸入「更多」看下一頁")
 
         # 儲存訊息
         st.session_state.messages.append({
             "role": "assistant",
             "content": text_msg,
-            "coupons": coupons
+            "coupons": coupons,
+            "coupon_start": coupon_start
         })
 
 
@@ -6,9 +6,9 @@ KFC 優惠券推薦 AI Agent - 主程序
 """
 
 import sys
-from src.agent import KFCAgent
+from src.agent import KFCAgent, extraction_cache_stats
 from config.config import config
-from src.utils import test_connection
+from src.utils import test_connection, get_llm_client
 
 
 def print_banner():
@@ -52,12 +52,21 @@ def run_cli():
             return
 
     # 智能載入優惠券（自動檢查是否需要更新）
-    from src.scraper import should_update_coupons, scrape_and_parse, load_coupons_from_cache
+    from src.scraper import (
+        should_update_coupons, scrape_and_parse, load_coupons_from_cache,
+        catalog, refresh_catalog_in_background
+    )
 
     print("📥 正在載入優惠券資料...")
     need_update, reason = should_update_coupons()
-
-    if need_update:
+    stale = load_coupons_from_cache() if need_update and config.STALE_WHILE_REVALIDATE else None
+
+    if stale:
+        # 先用舊資料啟動，背景更新完成後再替換
+        coupons = stale
+        print(f"📡 {reason}，先使用現有的 {len(coupons)} 張優惠券，並在背景更新...\n")
+        refresh_catalog_in_background()
+    elif need_update:
         print(f"📡 {reason}，正在更新優惠券...")
         try:
             coupons = scrape_and_parse(force_update=True)
@@ -78,6 +87,18 @@ def run_cli():
 
     # 創建 Agent
     agent = KFCAgent(coupons)
+    catalog_version = catalog.version
+
+    # 串流模式：即時印出 LLM 的輸出
+    streamed = []
+    if config.LLM_STREAM:
+        def print_token(chunk):
+            if not streamed:
+                print("💭 ", end="", flush=True)
+            streamed.append(chunk)
+            print(chunk, end="", flush=True)
+
+        agent.on_token = print_token
 
     # 顯示歡迎訊息
     print_banner()
@@ -110,14 +131,30 @@ def run_cli():
             if user_input.lower() == 'debug':
                 if config.DEBUG_MODE:
                     print(f"\n[DEBUG] 當前狀態：{agent.get_state()}")
-                    print(f"[DEBUG] 上下文：{agent.context}\n")
+                    print(f"[DEBUG] 上下文：{agent.context}")
+                    stats = extraction_cache_stats()
+                    print(f"[DEBUG] 提取快取：{stats['size']} 筆，命中率 {stats['hit_rate']:.0%}"
+                          f"（{stats['hits']}/{stats['hits'] + stats['misses']}）\n")
                 else:
                     print("\n💡 DEBUG 模式已關閉（在 .env 中設定 DEBUG_MODE=true 開啟）\n")
                 continue
 
+            # 背景更新完成：換上新的優惠券
+            version, latest = catalog.get()
+            if version != catalog_version and latest:
+                agent.update_coupons(latest)
+                catalog_version = version
+                print(f"\n🔄 優惠券已更新（共 {len(latest)} 張）")
+
             # 處理輸入
+            streamed.clear()
             response = agent.process(user_input)
 
+            if streamed:
+                timing = get_llm_client().last_timing or {}
+                ttft = timing.get("ttft")
+                print(f"\n   （首個 token {ttft:.2f}s）" if ttft is not None else "")
+
             # 顯示回應
             print(f"\nAgent > {response}\n")
 
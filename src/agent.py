@@ -6,11 +6,18 @@ KFC 優惠券推薦 AI Agent
 
 from enum import Enum
 import json
-from src.utils import call_llm
-from src.prompts import EXTRACT_INFO_PROMPT
+import unicodedata
+from src.utils import call_llm, call_llm_stream, acall_llm, discard_llm_response, normalize_item, LRUCache
+from src.prompts import build_extract_prompt, EXTRACT_INFO_SCHEMA, EXTRACT_INFO_STOP, EXTRACT_PROMPT_VERSION
+from src.intent_rules import extract_intent_with_rules, TRIGGER_WORDS
+from src.matcher import CouponIndex, top_matches
 from config.config import config
 
 
+# 看下一頁結果的說法
+MORE_WORDS = ["更多", "下一頁", "還有嗎", "more", "next"]
+
+
 class State(Enum):
     """FSM 狀態定義"""
     IDLE = "idle"
@@ -21,6 +28,44 @@ class State(Enum):
     DONE = "done"
 
 
+def normalize_utterance(text):
+    """
+    正規化使用者輸入（全形轉半形、英文轉小寫、去掉空白與標點），用來比對相同的說法
+
+    例如「３個人！」「3 個人」「3個人」都會變成「3個人」；
+    夾在兩個數字之間的符號會保留（「2-3人」與「23人」意思不同）
+
+    參數：
+        text: 使用者輸入的文字
+
+    回傳：
+        正規化後的文字
+    """
+    text = unicodedata.normalize("NFKC", text).lower()
+    kept = []
+    for i, ch in enumerate(text):
+        if ch.isspace() or unicodedata.category(ch).startswith("P"):
+            between_digits = 0 < i < len(text) - 1 and text[i - 1].isdigit() and text[i + 1].isdigit()
+            if not between_digits:
+                continue
+        kept.append(ch)
+    return "".join(kept)
+
+
+# 所有對話共用的意圖提取快取：{(prompt 版本, 範例數, 模型, 正規化輸入): 提取結果}
+_extraction_cache = LRUCache(maxsize=config.EXTRACTION_CACHE_SIZE)
+
+
+def extraction_cache_stats():
+    """
+    意圖提取快取的統計
+
+    回傳：
+        {"size", "hits", "misses", "evictions", "expirations", "hit_rate"}
+    """
+    return _extraction_cache.stats()
+
+
 class KFCAgent:
     """KFC 優惠券推薦 Agent"""
     
@@ -36,10 +81,16 @@ class KFCAgent:
         self.context = {
             "num_people": None,
             "preferences": [],
-            "filtered_coupons": []
+            "filtered_coupons": [],  # 目前這一頁的優惠券
+            "matches": [],  # 所有符合的優惠券（未排序）
+            "page_cursor": 0  # 已經顯示到第幾張
         }
         # 提取所有可用的品項
         self.available_items = self._extract_all_items()
+        # 品項倒排索引（比對時只看可能符合的優惠券）
+        self.index = CouponIndex(coupons)
+        # 串流回呼：設定後 LLM 以串流模式呼叫，每收到一段輸出就呼叫 on_token(chunk)
+        self.on_token = None
     
     def reset(self):
         """重置 Agent 到初始狀態"""
@@ -47,9 +98,22 @@ class KFCAgent:
         self.context = {
             "num_people": None,
             "preferences": [],
-            "filtered_coupons": []
+            "filtered_coupons": [],  # 目前這一頁的優惠券
+            "matches": [],  # 所有符合的優惠券（未排序）
+            "page_cursor": 0  # 已經顯示到第幾張
         }
     
+    def update_coupons(self, coupons):
+        """
+        替換優惠券資料（背景更新完成時呼叫），保留目前的對話狀態
+
+        參數：
+            coupons: 新的優惠券資料列表
+        """
+        self.coupons = coupons
+        self.available_items = self._extract_all_items()
+        self.index = CouponIndex(coupons)
+
     def get_state(self):
         """取得當前狀態（用於 debug）"""
         return self.state.value
@@ -91,13 +155,45 @@ class KFCAgent:
             if user_input.strip() in ["重來", "重新開始", "restart", "重新查詢"]:
                 self.reset()
                 return self.process("")
-            
+
+            # 下一頁
+            if user_input.strip().lower() in MORE_WORDS:
+                if self.context["page_cursor"] < len(self.context["matches"]):
+                    return self._show_page()
+                return f"已經是最後一頁了（共 {len(self.context['matches'])} 張），輸入「重來」可重新查詢"
+
             self.state = State.DONE
             return "還需要其他幫助嗎？（輸入「重來」可重新查詢）"
         
         # ========== 狀態：DONE ==========
         elif self.state == State.DONE:
             return "感謝使用！祝用餐愉快！🍗👋"
+
+    async def aprocess(self, user_input):
+        """
+        非同步處理使用者輸入（與 process 走同一個 FSM）
+
+        需要呼叫 LLM 的狀態（ASKING_INFO / SHOW_MENU）以非同步方式等待 LLM，
+        不會卡住事件迴圈；其他狀態不需要 LLM，直接交給 process。
+
+        參數：
+            user_input: 使用者輸入的文字
+
+        回傳：
+            Agent 的回應文字
+        """
+        if self.state in (State.ASKING_INFO, State.SHOW_MENU):
+            self.state = State.ASKING_INFO
+
+            extracted = self._extract_info_with_rules(user_input)
+            if extracted is None:
+                if config.DEBUG_MODE:
+                    print("[DEBUG] 正在呼叫 LLM 提取資訊...")
+                extracted = await self._aextract_info(user_input)
+
+            return self._apply_extracted(user_input, extracted)
+
+        return self.process(user_input)
     
     def _welcome_message(self):
         """歡迎訊息 + 顯示可選品項"""
@@ -141,12 +237,28 @@ class KFCAgent:
         - invalid → 停留在 ASKING_INFO
         """
         
-        if config.DEBUG_MODE:
-            print("[DEBUG] 正在呼叫 LLM 提取資訊...")
-        
-        # 用 LLM 提取資訊
-        extracted = self._extract_info(user_input)
-        
+        # 簡單的輸入先用規則提取，規則無法完全解釋時才呼叫 LLM
+        extracted = self._extract_info_with_rules(user_input)
+        if extracted is None:
+            if config.DEBUG_MODE:
+                print("[DEBUG] 正在呼叫 LLM 提取資訊...")
+
+            # 用 LLM 提取資訊
+            extracted = self._extract_info(user_input)
+
+        return self._apply_extracted(user_input, extracted)
+
+    def _apply_extracted(self, user_input, extracted):
+        """
+        根據提取結果更新 context 並決定狀態轉換（process 與 aprocess 共用）
+
+        參數：
+            user_input: 使用者輸入的文字
+            extracted: _extract_info 的結果（失敗為 None）
+
+        回傳：
+            Agent 的回應文字
+        """
         if not extracted:
             # LLM 呼叫失敗
             return "抱歉，我遇到了一些問題。請再說一次？"
@@ -172,8 +284,7 @@ class KFCAgent:
             print(f"[DEBUG] 累積資訊：人數={num_people}, 偏好={preferences}")
 
         # 檢查是否要開始查詢（使用者說「好了」「查詢」「完成」等）
-        trigger_words = ["好了", "查詢", "完成", "搜尋", "搜索", "找", "開始", "go", "ok", "確定"]
-        user_wants_search = any(word in user_input.lower() for word in trigger_words)
+        user_wants_search = any(word in user_input.lower() for word in TRIGGER_WORDS)
 
         # 如果資訊完整且使用者要查詢，就開始過濾
         if user_wants_search and num_people is not None and preferences:
@@ -208,6 +319,21 @@ class KFCAgent:
 
         return response
     
+    def _extract_info_with_rules(self, user_input):
+        """
+        用規則提取資訊（回傳格式同 _extract_info）
+
+        回傳：
+            提取結果，規則停用或輸入有無法解釋的內容時回傳 None
+        """
+        if not config.INTENT_RULES_ENABLED:
+            return None
+
+        result = extract_intent_with_rules(user_input)
+        if result is not None and config.DEBUG_MODE:
+            print(f"[DEBUG] 規則提取結果: {result}")
+        return result
+
     def _extract_info(self, user_input):
         """
         用 LLM 提取資訊
@@ -220,12 +346,94 @@ class KFCAgent:
         }
         """
         
-        # 建構 Prompt
-        prompt = EXTRACT_INFO_PROMPT.format(user_input=user_input)
-        
-        # 呼叫 LLM
-        response = call_llm(prompt)
+        # 其他對話問過一樣的話就直接沿用
+        key = self._extraction_cache_key(user_input)
+        cached = _extraction_cache.get(key) if key else None
+        if cached is not None:
+            if config.DEBUG_MODE:
+                print(f"[DEBUG] 提取快取命中: {cached}")
+            return dict(cached, preferences=list(cached["preferences"]))
+
+        # 建構 Prompt（只放和輸入相關的範例與同義詞）
+        prompt = build_extract_prompt(user_input)
         
+        options = self._extraction_options()
+
+        # 呼叫 LLM（有設定串流回呼時逐段回報輸出，JSON 物件一結束就停止產生）
+        if self.on_token:
+            response = call_llm_stream(prompt, on_token=self.on_token, until_json_complete=True, **options)
+        else:
+            response = call_llm(prompt, **options)
+
+        result = self._parse_extraction(response)
+        if result is None and response:
+            # 格式錯誤的回應不要留在快取裡，使用者重說一次才會重新呼叫 LLM
+            discard_llm_response(prompt, **options)
+        self._remember_extraction(key, result)
+        return result
+
+    async def _aextract_info(self, user_input):
+        """用 LLM 提取資訊（非同步版本，回傳格式同 _extract_info）"""
+        key = self._extraction_cache_key(user_input)
+        cached = _extraction_cache.get(key) if key else None
+        if cached is not None:
+            return dict(cached, preferences=list(cached["preferences"]))
+
+        prompt = build_extract_prompt(user_input)
+        options = self._extraction_options()
+        response = await acall_llm(prompt, **options)
+
+        result = self._parse_extraction(response)
+        if result is None and response:
+            discard_llm_response(prompt, **options)
+        self._remember_extraction(key, result)
+        return result
+
+    @staticmethod
+    def _extraction_cache_key(user_input):
+        """意圖提取快取的鍵（正規化後為空字串時不快取）"""
+        normalized = normalize_utterance(user_input)
+        if not normalized:
+            return None
+        # 範例數會改變 prompt 內容，也要放進鍵
+        return json.dumps(
+            [EXTRACT_PROMPT_VERSION, config.PROMPT_FEWSHOT_K, config.OLLAMA_MODEL, normalized], ensure_ascii=False
+        )
+
+    @staticmethod
+    def _remember_extraction(key, result):
+        """只快取格式正確的提取結果"""
+        if key and isinstance(result, dict) and isinstance(result.get("preferences", []), list):
+            _extraction_cache.set(key, {
+                "num_people": result.get("num_people"),
+                "preferences": list(result.get("preferences", [])),
+                "want_menu": bool(result.get("want_menu")),
+            })
+
+    def _extraction_options(self):
+        """
+        意圖提取的 LLM 參數：小的 max_tokens、結構化輸出格式與停止序列
+
+        回傳：
+            {"max_tokens", "format", "stop"}
+        """
+        formats = {"json": "json", "schema": EXTRACT_INFO_SCHEMA}
+        return {
+            "max_tokens": config.EXTRACT_MAX_TOKENS,
+            "format": formats.get(config.EXTRACT_FORMAT),
+            "stop": EXTRACT_INFO_STOP,
+        }
+
+    def _parse_extraction(self, response):
+        """
+        解析 LLM 回應中的 JSON
+
+        參數：
+            response: LLM 的回應文字（失敗為 None）
+
+        回傳：
+            提取結果 dict，解析失敗則回傳 None
+        """
         if not response:
             return None
         
@@ -256,19 +464,12 @@ class KFCAgent:
     
     def _extract_all_items(self):
         """從所有優惠券中提取不重複的品項（清理並分類）"""
-        import re
         all_items = set()
         for coupon in self.coupons:
             items = coupon.get('items', [])
             for item in items:
                 # 移除各種數量表示
-                cleaned = item
-                cleaned = re.sub(r'x\d+$', '', cleaned)  # 移除後綴 x1, x2 等
-                cleaned = re.sub(r'\(.*?\)', '', cleaned)  # 移除括號內容
-                cleaned = re.sub(r'\d+塊', '', cleaned)  # 移除數字+塊
-                cleaned = re.sub(r'^\d+', '', cleaned)  # 移除其他數字前綴
-                cleaned = cleaned.replace('?', '')  # 移除問號（編碼問題）
-                cleaned = cleaned.strip()
+                cleaned = normalize_item(item)
                 if cleaned:
                     all_items.add(cleaned)
 
@@ -336,62 +537,61 @@ class KFCAgent:
         if config.DEBUG_MODE:
             print(f"[DEBUG] 開始過濾：人數={num_people}, 偏好={preferences}")
         
-        # 過濾邏輯
-        filtered = []
-        
-        for coupon in self.coupons:
-            matched_items = []
-            matched_preferences = []  # 記錄符合了哪些偏好
+        # 過濾：只保留有匹配的優惠券（match_score > 0），排序留到分頁時用 heap 選出需要的部分
+        matches = self.index.score_matches(preferences, num_people)
 
-            # 檢查是否包含偏好
-            for pref in preferences:
-                for item in coupon["items"]:
-                    # 模糊匹配（雙向包含）
-                    if pref in item or item in pref:
-                        matched_items.append(item)
-                        matched_preferences.append(pref)
+        if config.DEBUG_MODE:
+            print(f"[DEBUG] 過濾結果：找到 {len(matches)} 張優惠券")
 
-            # 計算符合度分數（符合了幾個使用者偏好）
-            match_score = len(set(matched_preferences))  # 去重後符合的偏好數量
+        # 儲存
+        self.context["matches"] = matches
+        self.context["page_cursor"] = 0
+        self.context["filtered_coupons"] = []
 
-            # 檢查人數（允許±1）
-            people_diff = abs(coupon["serves"] - num_people)
+        # 格式化輸出
+        if not matches:
+            return self._format_no_results()
 
-            # 記錄（包含沒有匹配的優惠券，但分數為 0）
-            result = {
-                **coupon,
-                "matched_items": list(set(matched_items)),  # 去重
-                "match_score": match_score,  # 新增：符合度分數
-                "people_diff": people_diff,
-                "people_suitable": people_diff <= 1
-            }
+        return self._show_page()
 
-            filtered.append(result)
+    def _show_page(self):
+        """
+        顯示下一頁結果
 
-        # 排序：符合度（高→低）→ 人數接近度（低→高）→ 價格（低→高）
-        filtered.sort(key=lambda x: (-x["match_score"], x["people_diff"], x["price"]))
+        排序：符合度（高→低）→ 人數接近度（低→高）→ 價格（低→高）
+        只用 heap 選出到這一頁為止的前幾張，不排序全部結果。
+        """
+        matches = self.context["matches"]
+        start = self.context["page_cursor"]
+        end = start + config.RESULTS_PAGE_SIZE if config.RESULTS_PAGE_SIZE > 0 else len(matches)
 
-        # 只保留有匹配的優惠券（match_score > 0）
-        filtered = [c for c in filtered if c["match_score"] > 0]
+        page = top_matches(matches, end)[start:]
 
         if config.DEBUG_MODE:
-            print(f"[DEBUG] 過濾結果：找到 {len(filtered)} 張優惠券")
+            print(f"[DEBUG] 顯示第 {start + 1}-{start + len(page)} 張（共 {len(matches)} 張）")
 
-        # 儲存
-        self.context["filtered_coupons"] = filtered
+        self.context["filtered_coupons"] = page
+        self.context["page_cursor"] = start + len(page)
 
-        # 格式化輸出
-        if not filtered:
-            return self._format_no_results()
+        return self._format_results(page, total=len(matches), start=start)
 
-        return self._format_results(filtered)
-    
-    def _format_results(self, coupons):
-        """格式化結果"""
-        
-        result = f"\n✅ 找到 {len(coupons)} 張符合的優惠券：\n\n"
-        
-        for i, coupon in enumerate(coupons, 1):
+    def _format_results(self, coupons, total=None, start=0):
+        """
+        格式化結果
+
+        參數：
+            coupons: 這一頁的優惠券
+            total: 符合的優惠券總數（預設為 coupons 的數量）
+            start: 這一頁第一張的位置（編號從 start + 1 開始）
+        """
+        if total is None:
+            total = len(coupons)
+
+        result = f"\n✅ 找到 {total} 張符合的優惠券：\n\n"
+        if len(coupons) < total:
+            result += f"（第 {start + 1}-{start + len(coupons)} 張）\n\n"
+
+        for i, coupon in enumerate(coupons, start + 1):
             result += "=" * 60 + "\n"
             result += f"{i}. {coupon['name']}\n"
             result += "=" * 60 + "\n"
@@ -415,6 +615,9 @@ class KFCAgent:
         # 加上操作提示
         result += "=" * 60 + "\n"
         result += "💡 接下來你可以：\n"
+        remaining = total - start - len(coupons)
+        if remaining > 0:
+            result += f"   • 輸入「更多」看下 {min(remaining, config.RESULTS_PAGE_SIZE)} 張（還有 {remaining} 張）\n"
         result += "   • 輸入「重來」「重新開始」「restart」重新查詢\n"
         result += "   • 輸入其他內容結束對話\n"
         result += "=" * 60 + "\n"
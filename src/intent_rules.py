@@ -0,0 +1,225 @@
+# intent_rules.py
+"""
+規則式意圖提取
+
+在呼叫 LLM 之前先用規則處理簡單的輸入（「2」「3個人」「好了」「炸雞」），
+同義詞直接使用 prompts.py 的 EXTRACT_SYNONYM_SECTIONS，結果與 LLM 的回傳格式相同。
+輸入中有規則無法解釋的內容時回傳 None，交給 LLM 處理。
+"""
+
+import re
+from src.prompts import EXTRACT_SYNONYM_SECTIONS
+
+# 觸發查詢的詞（與 agent 判斷「開始查詢」共用）
+TRIGGER_WORDS = ["好了", "查詢", "完成", "搜尋", "搜索", "找", "開始", "go", "ok", "確定"]
+
+# 想看菜單的說法
+MENU_WORDS = [
+    "沒想法", "不知道", "隨便", "都可以", "有什麼", "看菜單", "菜單", "選擇困難", "推薦",
+    "多少錢", "價格", "便宜", "划算",
+]
+
+# 打招呼（不提取任何資訊）
+GREETING_WORDS = ["你好", "您好", "哈囉", "嗨", "在嗎", "hello", "hi"]
+
+# 直接對應人數的說法
+PEOPLE_PHRASES = {"一家人": 4, "全家": 4, "一個人": 1, "單人": 1, "自己": 1}
+
+# 沒有資訊量的字詞（移除後若還有剩下的內容，就交給 LLM）
+FILLER_WORDS = [
+    "我們", "我", "想要", "想吃", "想", "要", "吃", "點", "來", "給我", "請", "一下",
+    "和", "跟", "還有", "加", "有", "嗎", "呢", "吧", "啊", "的", "份", "人數", "什麼", "謝謝",
+]
+
+CHINESE_DIGITS = {"零": 0, "一": 1, "二": 2, "兩": 2, "三": 3, "四": 4, "五": 5,
+                  "六": 6, "七": 7, "八": 8, "九": 9}
+
+PEOPLE_PATTERN = re.compile(r"(\d+|[零一二兩三四五六七八九十]+)\s*(?:個人|人|位)")
+# 單獨的「個」只有在「我們兩個」這種說法才是人數（「我要一個」是份數）
+PEOPLE_GE_PATTERN = re.compile(r"(?:我們|咱們)\s*(\d+|[零一二兩三四五六七八九十]+)\s*個(?!人)")
+# 數字緊接在食物前面（「3個雞塊」）或後面（「雞塊10個」「炸雞2份」）是份數而不是人數
+FOOD_MARK = "\0"
+QUANTITY_UNITS = "個|塊|份|杯|顆|桶|隻"
+QUANTITY_PATTERN = re.compile(
+    r"(?:\d|[零一二兩三四五六七八九十])\s*(?:" + QUANTITY_UNITS + r")?\s*" + FOOD_MARK
+    + r"|" + FOOD_MARK + r"\s*(?:\d+|[零一二兩三四五六七八九十]+)\s*(?:" + QUANTITY_UNITS + r")(?!人)"
+)
+NUMBER_PATTERN = re.compile(r"\d+")
+RESIDUE_PATTERN = re.compile(r"[\w]", re.UNICODE)
+
+
+def _build_lexicon():
+    """同義詞表 → [(說法, 標準名稱)]，長的說法排前面（最長匹配優先）"""
+    lexicon = {}
+    for _, entries in EXTRACT_SYNONYM_SECTIONS:
+        for variants, canonical, _ in entries:
+            for phrase in variants + [canonical]:
+                lexicon.setdefault(phrase.lower(), canonical)
+    return sorted(lexicon.items(), key=lambda pair: len(pair[0]), reverse=True)
+
+
+FOOD_LEXICON = _build_lexicon()
+
+
+def parse_chinese_number(text):
+    """
+    解析中文數字（支援到 99），例如「三」→ 3、「十二」→ 12、「二十」→ 20
+
+    回傳：
+        整數，無法解析則回傳 None
+    """
+    if "十" in text:
+        tens, _, ones = text.partition("十")
+        if len(tens) > 1 or len(ones) > 1:
+            return None
+        tens_value = CHINESE_DIGITS.get(tens, None) if tens else 1
+        ones_value = CHINESE_DIGITS.get(ones, None) if ones else 0
+        if tens_value is None or ones_value is None:
+            return None
+        return tens_value * 10 + ones_value
+
+    if len(text) == 1:
+        return CHINESE_DIGITS.get(text)
+    return None
+
+
+def _consume(text, phrase):
+    """把 phrase 從 text 中挖掉（以空白取代，避免前後文字接起來產生新的詞）"""
+    return text.replace(phrase, " ")
+
+
+def scan_intent(user_input):
+    """
+    用規則掃描輸入，提取人數、偏好與是否想看菜單
+
+    參數：
+        user_input: 使用者輸入的文字
+
+    回傳：
+        (提取結果, 剩餘無法解釋的文字)
+        提取結果格式同 LLM：{"num_people", "preferences", "want_menu"}
+    """
+    text = user_input.lower()
+    num_people = None
+    people_mentions = 0
+    preferences = []
+    wants_menu = False
+
+    # 固定說法的人數（「一家人」要在食物與數字之前處理）
+    for phrase, value in PEOPLE_PHRASES.items():
+        if phrase in text:
+            num_people = value
+            people_mentions += 1
+            text = _consume(text, phrase)
+
+    # 食物（最長匹配優先）
+    for phrase, canonical in FOOD_LEXICON:
+        if phrase in text:
+            if canonical not in preferences:
+                preferences.append(canonical)
+            text = text.replace(phrase, FOOD_MARK)
+
+    # 食物前面有份數時交給 LLM 判斷
+    quantity = QUANTITY_PATTERN.search(text)
+    text = text.replace(FOOD_MARK, " ")
+
+    # 菜單、觸發、打招呼
+    for phrase in sorted(MENU_WORDS, key=len, reverse=True):
+        if phrase in text:
+            wants_menu = True
+            text = _consume(text, phrase)
+    for phrase in sorted(TRIGGER_WORDS + GREETING_WORDS, key=len, reverse=True):
+        text = _consume(text, phrase)
+
+    # 「3個人」「三位」「我們兩個」
+    unparsed_people = False
+    for pattern in (PEOPLE_PATTERN, PEOPLE_GE_PATTERN):
+        for match in pattern.finditer(text):
+            raw = match.group(1)
+            value = int(raw) if raw.isdigit() else parse_chinese_number(raw)
+            if value is not None:
+                num_people = value
+                people_mentions += 1
+            else:
+                # 「三四個人」「十十人」解析不了，留下殘餘讓 LLM 判斷
+                unparsed_people = True
+        text = pattern.sub(" ", text)
+
+    # 單純的數字（「2」「45」）視為人數；和食物一起出現時（「薯條 2」）可能是份數，交給 LLM
+    if num_people is None and not preferences:
+        numbers = NUMBER_PATTERN.findall(text)
+        if len(numbers) == 1:
+            num_people = int(numbers[0])
+            people_mentions += 1
+            text = NUMBER_PATTERN.sub(" ", text)
+
+    for phrase in sorted(FILLER_WORDS, key=len, reverse=True):
+        text = _consume(text, phrase)
+
+    # 出現多個人數、或數字其實是份數時，無法確定人數
+    if people_mentions > 1 or unparsed_people:
+        text += " 人數"
+    if quantity:
+        text += " 份數"
+
+    result = {
+        "num_people": num_people,
+        "preferences": preferences,
+        # 有提到具體食物時不顯示菜單
+        "want_menu": wants_menu and not preferences,
+    }
+    residue = "".join(RESIDUE_PATTERN.findall(text))
+    return result, residue
+
+
+def extract_intent_with_rules(user_input):
+    """
+    規則式意圖提取（只處理規則能完全解釋的輸入）
+
+    參數：
+        user_input: 使用者輸入的文字
+
+    回傳：
+        {"num_people", "preferences", "want_menu"}，有無法解釋的內容時回傳 None
+    """
+    if not user_input or not user_input.strip():
+        return None
+
+    result, residue = scan_intent(user_input)
+    if residue:
+        return None
+    return result
+
+
+# 回歸測試：(輸入, 預期結果)，None 表示應交給 LLM
+REGRESSION_CASES = [
+    ("2", {"num_people": 2, "preferences": [], "want_menu": False}),
+    ("3個人", {"num_people": 3, "preferences": [], "want_menu": False}),
+    ("我們兩個", {"num_people": 2, "preferences": [], "want_menu": False}),
+    ("3個人，想吃炸雞", {"num_people": 3, "preferences": ["炸雞"], "want_menu": False}),
+    ("炸雞 3個人", {"num_people": 3, "preferences": ["炸雞"], "want_menu": False}),
+    ("好了", {"num_people": None, "preferences": [], "want_menu": False}),
+    # 份數不是人數
+    ("3個雞塊", None),
+    ("雞塊10個", None),
+    ("蛋撻2個", None),
+    ("蛋撻6個 好了", None),
+    ("薯條 2", None),
+    ("炸雞2份", None),
+    ("我要一個", None),
+    # 解析不了的人數不能當作沒提到
+    ("三四個人", None),
+    ("十十人", None),
+]
+
+
+if __name__ == "__main__":
+    # 直接執行此檔案時跑回歸測試
+    failures = 0
+    for user_input, expected in REGRESSION_CASES:
+        actual = extract_intent_with_rules(user_input)
+        ok = actual == expected
+        failures += not ok
+        print(f"{'✅' if ok else '❌'} 「{user_input}」→ {actual}" + ("" if ok else f"（預期 {expected}）"))
+    print(f"\n{len(REGRESSION_CASES) - failures}/{len(REGRESSION_CASES)} 通過")
+    raise SystemExit(1 if failures else 0)
@@ -0,0 +1,240 @@
+# matcher.py
+"""
+優惠券比對：品項倒排索引 + Aho-Corasick 自動機
+
+每次載入優惠券時建立一次索引，查詢時只處理可能符合的優惠券，
+比對規則（偏好與品項雙向包含）與排序方式都和原本逐張比對完全相同。
+"""
+
+import heapq
+from collections import defaultdict, deque
+
+
+def rank_key(result):
+    """排序鍵：符合度（高→低）→ 人數接近度（低→高）→ 價格（低→高）"""
+    return (-result["match_score"], result["people_diff"], result["price"])
+
+
+def top_matches(results, k):
+    """
+    取出排序後的前 k 筆（heap 選擇，不排序整個列表）
+
+    heapq.nsmallest 遇到同分時保留原本順序，結果與 sorted(results, key=rank_key)[:k] 相同。
+
+    參數：
+        results: score_matches 的結果
+        k: 筆數
+
+    回傳：
+        排序後的前 k 筆
+    """
+    return heapq.nsmallest(k, results, key=rank_key)
+
+
+class AhoCorasick:
+    """
+    Aho-Corasick 多字串比對自動機
+
+    一次掃描文字（線性時間）就找出所有出現在文字中的 pattern。
+    """
+
+    def __init__(self, patterns):
+        """
+        編譯自動機
+
+        參數：
+            patterns: 要尋找的字串（空字串會被忽略，由呼叫端自行處理）
+        """
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+
+        for pattern in set(patterns):
+            if not pattern:
+                continue
+            node = 0
+            for ch in pattern:
+                next_node = self.goto[node].get(ch)
+                if next_node is None:
+                    next_node = len(self.goto)
+                    self.goto[node][ch] = next_node
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                node = next_node
+            self.output[node].append(pattern)
+
+        # BFS 建立失敗連結，並把失敗節點的輸出併進來
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in self.goto[node].items():
+                queue.append(child)
+                fallback = self.fail[node]
+                while fallback and ch not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                target = self.goto[fallback].get(ch, 0)
+                self.fail[child] = target if target != child else 0
+                self.output[child] = self.output[child] + self.output[self.fail[child]]
+
+    def findall(self, text):
+        """
+        找出所有出現在 text 中的 pattern
+
+        參數：
+            text: 要掃描的文字
+
+        回傳：
+            出現過的 pattern 集合
+        """
+        found = set()
+        node = 0
+        for ch in text:
+            while node and ch not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(ch, 0)
+            if self.output[node]:
+                found.update(self.output[node])
+        return found
+
+
+class CouponIndex:
+    """
+    品項 → 優惠券的倒排索引
+
+    - item_positions：品項字串 → 含有該品項的優惠券位置（依原本順序）
+    - item_automaton：所有品項編成的 Aho-Corasick 自動機（找出「品項 in 偏好」）
+    """
+
+    def __init__(self, coupons):
+        """
+        建立索引
+
+        參數：
+            coupons: 優惠券資料列表
+        """
+        self.coupons = coupons
+        self.item_positions = defaultdict(list)
+
+        for position, coupon in enumerate(coupons):
+            for item in coupon.get("items", []):
+                positions = self.item_positions[item]
+                if not positions or positions[-1] != position:
+                    positions.append(position)
+
+        self.item_automaton = AhoCorasick(self.item_positions)
+
+    def items_by_preference(self, preferences):
+        """
+        找出每個偏好雙向包含的品項（pref in item 或 item in pref）
+
+        - 品項 in 偏好：用品項自動機掃描偏好
+        - 偏好 in 品項：把這次的偏好編成自動機，掃描一次所有品項
+        空字串是任何字串的子字串，另外處理以維持與 in 運算相同的結果。
+
+        參數：
+            preferences: 使用者偏好列表
+
+        回傳：
+            {偏好: 符合的品項集合}
+        """
+        matches = {pref: self.item_automaton.findall(pref) for pref in preferences}
+
+        if "" in self.item_positions:
+            for pref in preferences:
+                matches[pref].add("")
+
+        for pref in preferences:
+            if pref == "":
+                matches[pref].update(self.item_positions)
+
+        pref_automaton = AhoCorasick(preferences)
+        for item in self.item_positions:
+            for pref in pref_automaton.findall(item):
+                matches[pref].add(item)
+
+        return matches
+
+    def candidates(self, preferences, matches=None):
+        """
+        可能符合任一偏好的優惠券位置（依原本順序）
+
+        參數：
+            preferences: 使用者偏好列表
+            matches: 已算好的 items_by_preference 結果（可省略）
+
+        回傳：
+            優惠券位置列表
+        """
+        if matches is None:
+            matches = self.items_by_preference(preferences)
+        positions = set()
+        for items in matches.values():
+            for item in items:
+                positions.update(self.item_positions[item])
+        return sorted(positions)
+
+    def score_matches(self, preferences, num_people):
+        """
+        找出符合偏好的優惠券並計算分數（不排序，依優惠券原本順序）
+
+        參數：
+            preferences: 使用者偏好列表
+            num_people: 用餐人數
+
+        回傳：
+            符合的優惠券列表（附加 matched_items / match_score / people_diff / people_suitable）
+        """
+        results = []
+        matches = self.items_by_preference(preferences)
+
+        for position in self.candidates(preferences, matches):
+            coupon = self.coupons[position]
+            matched_items = []
+            matched_preferences = []  # 記錄符合了哪些偏好
+
+            # 檢查是否包含偏好（雙向包含的結果已由自動機算好，這裡只查集合）
+            for pref in preferences:
+                pref_items = matches[pref]
+                for item in coupon["items"]:
+                    if item in pref_items:
+                        matched_items.append(item)
+                        matched_preferences.append(pref)
+
+            # 計算符合度分數（符合了幾個使用者偏好）
+            match_score = len(set(matched_preferences))  # 去重後符合的偏好數量
+
+            # 檢查人數（允許±1）
+            people_diff = abs(coupon["serves"] - num_people)
+
+            results.append({
+                **coupon,
+                "matched_items": list(set(matched_items)),  # 去重
+                "match_score": match_score,  # 符合度分數
+                "people_diff": people_diff,
+                "people_suitable": people_diff <= 1
+            })
+
+        return results
+
+    def find_matches(self, preferences, num_people, limit=None):
+        """
+        找出符合偏好的優惠券並排序
+
+        排序：符合度（高→低）→ 人數接近度（低→高）→ 價格（低→高）
+
+        參數：
+            preferences: 使用者偏好列表
+            num_people: 用餐人數
+            limit: 只取前幾筆（用 heap 選擇；None 表示全部排序）
+
+        回傳：
+            符合的優惠券列表（附加 matched_items / match_score / people_diff / people_suitable）
+        """
+        results = self.score_matches(preferences, num_people)
+        if limit is not None:
+            return top_matches(results, limit)
+
+        # 先過濾再排序：sort 是穩定排序，結果與「全部排序後再過濾」相同
+        results.sort(key=rank_key)
+        return results
@@ -0,0 +1,351 @@
+# mock_ollama.py
+"""
+本機模擬 Ollama 伺服器（離線測試、壓力測試用）
+
+實作 /generate 與 /chat（串流與非串流），依 Prompt 類型用規則產生回應：
+- 意圖提取（EXTRACT_INFO_PROMPT）→ {"num_people", "preferences", "want_menu"}
+- 單張 / 批次優惠券解析（PARSE_PROMPT / BATCH_PARSE_PROMPT）→ 用規則解析器產生 JSON
+- 連線測試（請只回答「OK」）→ OK
+
+可設定延遲分布、錯誤率與 token 產生速度，用來在沒有真正 LLM 的情況下量測整個系統的吞吐量。
+
+使用方式：
+    python -m src.mock_ollama --port 11434 --latency lognormal:0.8,0.5 --error-rate 0.05 --tokens-per-second 40
+    然後在 .env 設定 OLLAMA_API_URL=http://127.0.0.1:11434/api
+"""
+
+import re
+import json
+import math
+import time
+import random
+import logging
+import argparse
+import threading
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+
+# ========== 規則產生回應 ==========
+
+def mock_extract_info(user_input):
+    """
+    用規則模擬意圖提取（忽略規則無法解釋的部分，一定會有結果）
+
+    參數：
+        user_input: 使用者訊息
+
+    回傳：
+        {"num_people", "preferences", "want_menu"}
+    """
+    from src.intent_rules import scan_intent
+
+    result, _ = scan_intent(user_input)
+    return result
+
+
+def mock_parse_coupon(items_raw, price):
+    """
+    用規則解析器模擬單張優惠券解析（規則無法解析時把整段描述當成一個品項）
+
+    回傳：
+        {"name", "items", "serves", "description"}
+    """
+    from src.scraper import parse_coupon_with_rules
+
+    coupon, _ = parse_coupon_with_rules({"items_raw": items_raw, "price": price})
+    if coupon is None:
+        return {"name": f"優惠 {price}元", "items": [items_raw], "serves": 1, "description": items_raw}
+    return {field: coupon[field] for field in ("name", "items", "serves", "description")}
+
+
+USER_INPUT_PATTERN = re.compile(r"使用者說：「(.*?)」\n", re.S)
+SINGLE_COUPON_PATTERN = re.compile(r"優惠券描述：「(.*?)」\n優惠價格：(\d+)元", re.S)
+BATCH_LINE_PATTERN = re.compile(r"^- code: (.*?)｜描述：「(.*?)」｜價格：(\d+)元$", re.M)
+
+
+def mock_respond(prompt):
+    """
+    依 Prompt 類型產生回應文字
+
+    參數：
+        prompt: 收到的提示詞
+
+    回傳：
+        回應文字
+    """
+    batch = BATCH_LINE_PATTERN.findall(prompt)
+    if batch:
+        return json.dumps(
+            [dict(code=code, **mock_parse_coupon(items_raw, int(price))) for code, items_raw, price in batch],
+            ensure_ascii=False
+        )
+
+    match = SINGLE_COUPON_PATTERN.search(prompt)
+    if match:
+        return json.dumps(mock_parse_coupon(match.group(1), int(match.group(2))), ensure_ascii=False)
+
+    match = USER_INPUT_PATTERN.search(prompt)
+    if match:
+        return json.dumps(mock_extract_info(match.group(1)), ensure_ascii=False)
+
+    return "OK"
+
+
+def split_tokens(text):
+    """
+    把回應切成 token（中日韓文字每字一個，其他字元約每 4 個一個，與 estimate_tokens 一致）
+
+    回傳：
+        token 字串列表（串接起來等於原文）
+    """
+    tokens = []
+    buffer = ""
+    for ch in text:
+        if ord(ch) >= 0x2E80:
+            if buffer:
+                tokens.append(buffer)
+                buffer = ""
+            tokens.append(ch)
+        else:
+            buffer += ch
+            if len(buffer) == 4:
+                tokens.append(buffer)
+                buffer = ""
+    if buffer:
+        tokens.append(buffer)
+    return tokens
+
+
+# ========== 延遲與錯誤設定 ==========
+
+class MockProfile:
+    """
+    模擬伺服器的行為設定
+
+    latency 格式（首個 token 前的延遲，秒）：
+    - fixed:0.5
+    - uniform:0.2,1.0
+    - normal:0.8,0.2（平均, 標準差）
+    - lognormal:0.8,0.5（中位數, 對數標準差，長尾）
+    """
+
+    def __init__(self, latency="fixed:0", error_rate=0.0, tokens_per_second=0.0, seed=None):
+        """
+        參數：
+            latency: 延遲分布（見類別說明）
+            error_rate: 回傳 500 錯誤的機率（0.0-1.0）
+            tokens_per_second: token 產生速度（0 表示不限速）
+            seed: 亂數種子（固定後每次執行的延遲序列相同）
+        """
+        self.latency = latency
+        self.error_rate = error_rate
+        self.tokens_per_second = tokens_per_second
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._sampler = self._parse_latency(latency)
+
+    def _parse_latency(self, spec):
+        kind, _, args = spec.partition(":")
+        values = [float(v) for v in args.split(",") if v.strip()] if args else []
+
+        expected = {"fixed": (0, 1), "uniform": (2,), "normal": (2,), "lognormal": (2,)}
+        if kind not in expected:
+            raise ValueError(f"不支援的延遲分布：{spec}")
+        if len(values) not in expected[kind]:
+            raise ValueError(f"延遲分布 {kind} 需要 {' 或 '.join(map(str, expected[kind]))} 個參數：{spec}")
+        if not all(math.isfinite(v) for v in values):
+            raise ValueError(f"延遲參數必須是有限的數字：{spec}")
+
+        # 數值範圍：延遲不能是負的，標準差不能是負的，lognormal 的中位數要取 log
+        if kind in ("fixed", "uniform") and any(v < 0 for v in values):
+            raise ValueError(f"延遲不能是負數：{spec}")
+        if kind == "uniform" and values[0] > values[1]:
+            raise ValueError(f"uniform 的下限不能大於上限：{spec}")
+        if kind in ("normal", "lognormal") and values[1] < 0:
+            raise ValueError(f"{kind} 的標準差不能是負數：{spec}")
+        if kind == "lognormal" and values[0] <= 0:
+            raise ValueError(f"lognormal 的中位數必須大於 0：{spec}")
+
+        if kind == "fixed":
+            return lambda rnd: values[0] if values else 0.0
+        if kind == "uniform":
+            return lambda rnd: rnd.uniform(values[0], values[1])
+        if kind == "normal":
+            return lambda rnd: max(rnd.gauss(values[0], values[1]), 0.0)
+        return lambda rnd: rnd.lognormvariate(math.log(values[0]), values[1])
+
+    def sample_latency(self):
+        with self._lock:
+            return self._sampler(self._random)
+
+    def should_fail(self):
+        with self._lock:
+            return self._random.random() < self.error_rate
+
+    def token_delay(self):
+        return 1.0 / self.tokens_per_second if self.tokens_per_second > 0 else 0.0
+
+
+class MockOllamaHandler(BaseHTTPRequestHandler):
+    """處理 /generate 與 /chat（路徑可帶 /api 前綴）"""
+
+    protocol_version = "HTTP/1.1"
+    profile = MockProfile()
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} - {format % args}")
+
+    def _send_json(self, status, data):
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _write_chunk(self, data):
+        line = (json.dumps(data, ensure_ascii=False) + "\n").encode("utf-8")
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+        self.wfile.flush()
+
+    def do_POST(self):
+        try:
+            self._handle_post()
+        except (BrokenPipeError, ConnectionResetError):
+            # 用戶端提前關閉連線（例如 JSON 完整後提前結束串流）是正常情況
+            logger.debug(f"{self.address_string()} - 用戶端已中斷連線")
+            self.close_connection = True
+
+    def _handle_post(self):
+        endpoint = self.path.rstrip("/").rsplit("/", 1)[-1]
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except json.JSONDecodeError:
+            self._send_json(400, {"error": "invalid JSON"})
+            return
+
+        if endpoint not in ("generate", "chat"):
+            self._send_json(404, {"error": f"unknown endpoint: {self.path}"})
+            return
+
+        start = time.perf_counter()
+        time.sleep(self.profile.sample_latency())
+
+        if self.profile.should_fail():
+            self._send_json(500, {"error": "mock server error"})
+            return
+
+        if endpoint == "chat":
+            messages = body.get("messages") or [{}]
+            prompt = messages[-1].get("content", "")
+        else:
+            prompt = body.get("prompt", "")
+
+        options = body.get("options") or {}
+        text = mock_respond(prompt)
+        for stop in options.get("stop") or []:
+            if stop and stop in text:
+                text = text[:text.index(stop)]
+
+        tokens = split_tokens(text)
+        max_tokens = options.get("num_predict")
+        if max_tokens:
+            tokens = tokens[:max_tokens]
+
+        def message(text, done, **extra):
+            data = {
+                "model": body.get("model", "mock"),
+                "created_at": datetime.now(timezone.utc).isoformat(),
+                "done": done,
+                **extra,
+            }
+            if endpoint == "chat":
+                data["message"] = {"role": "assistant", "content": text}
+            else:
+                data["response"] = text
+            return data
+
+        def final_stats():
+            return {
+                "total_duration": int((time.perf_counter() - start) * 1e9),
+                "prompt_eval_count": len(split_tokens(prompt)),
+                "eval_count": len(tokens),
+            }
+
+        delay = self.profile.token_delay()
+
+        if body.get("stream", True):
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for token in tokens:
+                if delay:
+                    time.sleep(delay)
+                self._write_chunk(message(token, False))
+            self._write_chunk(message("", True, **final_stats()))
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+            return
+
+        if delay:
+            time.sleep(delay * len(tokens))
+        self._send_json(200, message("".join(tokens), True, **final_stats()))
+
+
+def start_mock_server(host="127.0.0.1", port=0, profile=None):
+    """
+    在背景執行緒啟動模擬伺服器（給測試與壓測腳本用）
+
+    參數：
+        host: 綁定位址
+        port: 埠號（0 表示自動選擇）
+        profile: MockProfile（預設無延遲、無錯誤）
+
+    回傳：
+        (server, api_url)，api_url 可直接當作 OLLAMA_API_URL；結束時呼叫 server.shutdown()
+    """
+    handler = type("ConfiguredMockOllamaHandler", (MockOllamaHandler,), {"profile": profile or MockProfile()})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="mock-ollama", daemon=True).start()
+    return server, f"http://{host}:{server.server_port}/api"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本機模擬 Ollama 伺服器")
+    parser.add_argument("--host", default="127.0.0.1", help="綁定位址")
+    parser.add_argument("--port", type=int, default=11434, help="埠號")
+    parser.add_argument("--latency", default="fixed:0",
+                        help="首個 token 前的延遲分布：fixed:S / uniform:A,B / normal:MEAN,STD / lognormal:MEDIAN,SIGMA")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="回傳 500 錯誤的機率（0.0-1.0）")
+    parser.add_argument("--tokens-per-second", type=float, default=0.0, help="token 產生速度（0 表示不限速）")
+    parser.add_argument("--seed", type=int, default=None, help="亂數種子")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    profile = MockProfile(args.latency, args.error_rate, args.tokens_per_second, args.seed)
+    MockOllamaHandler.profile = profile
+    server = ThreadingHTTPServer((args.host, args.port), MockOllamaHandler)
+    server.daemon_threads = True
+
+    print(f"🧪 模擬 Ollama 伺服器：http://{args.host}:{args.port}/api")
+    print(f"   延遲：{args.latency}，錯誤率：{args.error_rate:.0%}，"
+          f"速度：{args.tokens_per_second or '不限'} tokens/s")
+    print(f"   在 .env 設定 OLLAMA_API_URL=http://{args.host}:{args.port}/api")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n👋 已停止")
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -3,7 +3,21 @@
 LLM Prompt 模板
 """
 
-EXTRACT_INFO_PROMPT = """從使用者訊息提取資訊。你需要靈活理解各種口語化的表達方式。
+import re
+import logging
+from src.utils import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+
+# ========== 意圖提取 Prompt ==========
+# 拆成 開頭 → 同義詞 → 規則 → 範例 幾個部分，EXTRACT_INFO_PROMPT 是全部組合起來的完整版；
+# build_extract_prompt 只挑和使用者輸入相關的同義詞與最相似的幾個範例，縮短 prompt。
+
+# 組合後的 prompt 有變動時要更新版本號（讓依 prompt 版本快取的結果失效）
+EXTRACT_PROMPT_VERSION = "2"
+
+EXTRACT_INFO_HEADER = """從使用者訊息提取資訊。你需要靈活理解各種口語化的表達方式。
 
 使用者說：「{user_input}」
 
@@ -21,34 +35,39 @@ EXTRACT_INFO_PROMPT = """從使用者訊息提取資訊。你需要靈活理解
   * 如果沒提到人數 → null
 
 - 偏好：提取所有提到的食物類型（靈活匹配同義詞，適度標準化）
+"""
 
-  **炸雞類同義詞：**
-  * 「炸雞」「脆雞」「辣雞」→ ["炸雞"]
-  * 「辣脆雞」→ ["辣脆雞"]
-  * 「香麻脆雞」「青花椒香麻脆雞」「麻辣雞」→ ["香麻脆雞"]
-  * 「花雕紙包雞」「花雕雞」→ ["花雕紙包雞"]
-  * 「香酥脆薯」→ ["香酥脆薯"]
-
-  **雞塊類同義詞：**
-  * 「雞塊」「上校雞塊」「nugget」→ ["雞塊"]
-  * 「雞塊分享盒」「上校雞塊分享盒」「分享盒」→ ["雞塊"]
-
-  **漢堡類同義詞：**
-  * 「漢堡」「雞腿堡」「堡」→ ["漢堡"]
-
-  **飲料類同義詞：**
-  * 「可樂」「百事可樂」「汽水」→ ["可樂"]
-  * 「綠茶」「無糖綠茶」「茶」→ ["綠茶"]
-  * 「奶茶」「冰奶茶」→ ["奶茶"]
-
-  **甜點類同義詞：**
-  * 「蛋塔」「蛋撻」「原味蛋撻」「甜點」→ ["蛋撻"]（統一用「蛋撻」）
-  * 「QQ球」「雙色轉轉QQ球」「轉轉球」→ ["QQ球"]
-
-  **其他同義詞：**
-  * 「薯條」「薯」「炸薯條」→ ["薯條"]
-
-  **重要規則：**
+# 同義詞：(分類, [(說法, 標準名稱, 附註)])
+EXTRACT_SYNONYM_SECTIONS = [
+    ("炸雞類", [
+        (["炸雞", "脆雞", "辣雞"], "炸雞", ""),
+        (["辣脆雞"], "辣脆雞", ""),
+        (["香麻脆雞", "青花椒香麻脆雞", "麻辣雞"], "香麻脆雞", ""),
+        (["花雕紙包雞", "花雕雞"], "花雕紙包雞", ""),
+        (["香酥脆薯"], "香酥脆薯", ""),
+    ]),
+    ("雞塊類", [
+        (["雞塊", "上校雞塊", "nugget"], "雞塊", ""),
+        (["雞塊分享盒", "上校雞塊分享盒", "分享盒"], "雞塊", ""),
+    ]),
+    ("漢堡類", [
+        (["漢堡", "雞腿堡", "堡"], "漢堡", ""),
+    ]),
+    ("飲料類", [
+        (["可樂", "百事可樂", "汽水"], "可樂", ""),
+        (["綠茶", "無糖綠茶", "茶"], "綠茶", ""),
+        (["奶茶", "冰奶茶"], "奶茶", ""),
+    ]),
+    ("甜點類", [
+        (["蛋塔", "蛋撻", "原味蛋撻", "甜點"], "蛋撻", "（統一用「蛋撻」）"),
+        (["QQ球", "雙色轉轉QQ球", "轉轉球"], "QQ球", ""),
+    ]),
+    ("其他", [
+        (["薯條", "薯", "炸薯條"], "薯條", ""),
+    ]),
+]
+
+EXTRACT_INFO_RULES = """  **重要規則：**
   * 只提取使用者**明確提到**的食物
   * 絕對不要猜測或添加使用者沒說的食物
   * 如果使用者沒提到任何食物，preferences 必須是 []
@@ -73,70 +92,155 @@ EXTRACT_INFO_PROMPT = """從使用者訊息提取資訊。你需要靈活理解
   "preferences": ["食物1", "食物2"] 或 [],
   "want_menu": true或false
 }}
+"""
 
-範例：
-輸入：「3個人，想吃炸雞」
-輸出：{{"num_people": 3, "preferences": ["炸雞"], "want_menu": false}}
+# 範例：(輸入, 輸出 JSON)
+EXTRACT_INFO_EXAMPLES = [
+    ("3個人，想吃炸雞", '{"num_people": 3, "preferences": ["炸雞"], "want_menu": false}'),
+    ("2個人，沒想法", '{"num_people": 2, "preferences": [], "want_menu": true}'),
+    ("我想吃脆雞和薯條", '{"num_people": null, "preferences": ["炸雞", "薯條"], "want_menu": false}'),
+    ("一家人吃，有炸雞和蛋塔嗎", '{"num_people": 4, "preferences": ["炸雞", "蛋撻"], "want_menu": false}'),
+    ("不知道要吃什麼，給我推薦", '{"num_people": null, "preferences": [], "want_menu": true}'),
+    ("你好", '{"num_people": null, "preferences": [], "want_menu": false}'),
+    ("有什麼便宜的", '{"num_people": null, "preferences": [], "want_menu": true}'),
+    ("雞塊", '{"num_people": null, "preferences": ["雞塊"], "want_menu": false}'),
+    ("我想吃雞塊", '{"num_people": null, "preferences": ["雞塊"], "want_menu": false}'),
+    ("2", '{"num_people": 2, "preferences": [], "want_menu": false}'),
+    ("3個人", '{"num_people": 3, "preferences": [], "want_menu": false}'),
+    ("45", '{"num_people": 45, "preferences": [], "want_menu": false}'),
+    ("100", '{"num_people": 100, "preferences": [], "want_menu": false}'),
+    ("好了", '{"num_people": null, "preferences": [], "want_menu": false}'),
+    ("ok", '{"num_people": null, "preferences": [], "want_menu": false}'),
+    ("我想吃辣脆雞", '{"num_people": null, "preferences": ["辣脆雞"], "want_menu": false}'),
+    ("上校雞塊", '{"num_people": null, "preferences": ["雞塊"], "want_menu": false}'),
+    ("3個人，想吃香麻脆雞和蛋撻", '{"num_people": 3, "preferences": ["香麻脆雞", "蛋撻"], "want_menu": false}'),
+    ("有QQ球嗎", '{"num_people": null, "preferences": ["QQ球"], "want_menu": false}'),
+    ("花雕雞和綠茶", '{"num_people": null, "preferences": ["花雕紙包雞", "綠茶"], "want_menu": false}'),
+    ("雞腿堡和薯條", '{"num_people": null, "preferences": ["漢堡", "薯條"], "want_menu": false}'),
+]
+
+EXTRACT_INFO_FOOTER = """
+現在處理：
+"""
 
-輸入：「2個人，沒想法」
-輸出：{{"num_people": 2, "preferences": [], "want_menu": true}}
 
-輸入：「我想吃脆雞和薯條」
-輸出：{{"num_people": null, "preferences": ["炸雞", "薯條"], "want_menu": false}}
+def _render_synonym_section(title, entries):
+    lines = [f"  **{title}同義詞：**"]
+    for variants, canonical, note in entries:
+        phrases = "".join(f"「{variant}」" for variant in variants)
+        lines.append(f'  * {phrases}→ ["{canonical}"]{note}')
+    return "\n".join(lines) + "\n\n"
 
-輸入：「一家人吃，有炸雞和蛋塔嗎」
-輸出：{{"num_people": 4, "preferences": ["炸雞", "蛋撻"], "want_menu": false}}
 
-輸入：「不知道要吃什麼，給我推薦」
-輸出：{{"num_people": null, "preferences": [], "want_menu": true}}
+def _render_examples(examples):
+    # 範例會經過 str.format，JSON 的大括號要跳脫
+    return "範例：\n" + "".join(
+        f"輸入：「{text}」\n輸出：{output.replace('{', '{{').replace('}', '}}')}\n\n"
+        for text, output in examples
+    ).rstrip("\n") + "\n"
 
-輸入：「你好」
-輸出：{{"num_people": null, "preferences": [], "want_menu": false}}
 
-輸入：「有什麼便宜的」
-輸出：{{"num_people": null, "preferences": [], "want_menu": true}}
+def _assemble_extract_prompt(sections, examples):
+    return (
+        EXTRACT_INFO_HEADER + "\n"
+        + "".join(_render_synonym_section(title, entries) for title, entries in sections)
+        + EXTRACT_INFO_RULES + "\n"
+        + _render_examples(examples)
+        + EXTRACT_INFO_FOOTER
+    )
 
-輸入：「雞塊」
-輸出：{{"num_people": null, "preferences": ["雞塊"], "want_menu": false}}
 
-輸入：「我想吃雞塊」
-輸出：{{"num_people": null, "preferences": ["雞塊"], "want_menu": false}}
+# 完整版（所有同義詞與範例）
+EXTRACT_INFO_PROMPT = _assemble_extract_prompt(EXTRACT_SYNONYM_SECTIONS, EXTRACT_INFO_EXAMPLES)
 
-輸入：「2」
-輸出：{{"num_people": 2, "preferences": [], "want_menu": false}}
 
-輸入：「3個人」
-輸出：{{"num_people": 3, "preferences": [], "want_menu": false}}
+# ---------- 動態挑選範例 ----------
 
-輸入：「45」
-輸出：{{"num_people": 45, "preferences": [], "want_menu": false}}
+def _char_ngrams(text):
+    """字元 unigram + bigram（數字一律視為 0，讓「5個人」與「3個人」相似）"""
+    text = re.sub(r"\d", "0", text.lower())
+    return {text[i:i + n] for n in (1, 2) for i in range(len(text) - n + 1)}
 
-輸入：「100」
-輸出：{{"num_people": 100, "preferences": [], "want_menu": false}}
 
-輸入：「好了」
-輸出：{{"num_people": null, "preferences": [], "want_menu": false}}
+_EXAMPLE_NGRAMS = [_char_ngrams(text) for text, _ in EXTRACT_INFO_EXAMPLES]
 
-輸入：「ok」
-輸出：{{"num_people": null, "preferences": [], "want_menu": false}}
 
-輸入：「我想吃辣脆雞」
-輸出：{{"num_people": null, "preferences": ["辣脆雞"], "want_menu": false}}
+def _similarity(a, b):
+    """Dice 係數"""
+    if not a or not b:
+        return 0.0
+    return 2 * len(a & b) / (len(a) + len(b))
 
-輸入：「上校雞塊」
-輸出：{{"num_people": null, "preferences": ["雞塊"], "want_menu": false}}
 
-輸入：「3個人，想吃香麻脆雞和蛋撻」
-輸出：{{"num_people": 3, "preferences": ["香麻脆雞", "蛋撻"], "want_menu": false}}
+def _section_is_relevant(entries, text_bigrams, text):
+    for variants, canonical, _ in entries:
+        for phrase in variants + [canonical]:
+            if len(phrase) == 1:
+                if phrase in text:
+                    return True
+            elif _char_ngrams(phrase) & text_bigrams:
+                return True
+    return False
 
-輸入：「有QQ球嗎」
-輸出：{{"num_people": null, "preferences": ["QQ球"], "want_menu": false}}
 
-輸入：「花雕雞和綠茶」
-輸出：{{"num_people": null, "preferences": ["花雕紙包雞", "綠茶"], "want_menu": false}}
+def build_extract_prompt(user_input, k=None):
+    """
+    建立意圖提取的 Prompt，只放和輸入相關的內容
 
-輸入：「雞腿堡和薯條」
-輸出：{{"num_people": null, "preferences": ["漢堡", "薯條"], "want_menu": false}}
+    - 範例：用字元 n-gram 相似度挑出最相似的 k 個（保持原本順序）
+    - 同義詞：只放說法和輸入有共同字元 bigram 的分類
+    k 為 0 時回傳完整的 EXTRACT_INFO_PROMPT。
 
-現在處理：
-"""
\ No newline at end of file
+    參數：
+        user_input: 使用者輸入的文字
+        k: 範例數（預設用配置檔的 PROMPT_FEWSHOT_K）
+
+    回傳：
+        填入使用者輸入的 Prompt
+    """
+    from config.config import config
+
+    if k is None:
+        k = config.PROMPT_FEWSHOT_K
+
+    full_prompt = EXTRACT_INFO_PROMPT.format(user_input=user_input)
+    if k <= 0:
+        return full_prompt
+
+    grams = _char_ngrams(user_input)
+    bigrams = {gram for gram in grams if len(gram) == 2}
+
+    ranked = sorted(
+        range(len(EXTRACT_INFO_EXAMPLES)),
+        key=lambda i: (-_similarity(grams, _EXAMPLE_NGRAMS[i]), i)
+    )
+    examples = [EXTRACT_INFO_EXAMPLES[i] for i in sorted(ranked[:k])]
+    sections = [
+        (title, entries) for title, entries in EXTRACT_SYNONYM_SECTIONS
+        if _section_is_relevant(entries, bigrams, user_input.lower())
+    ]
+
+    prompt = _assemble_extract_prompt(sections, examples).format(user_input=user_input)
+
+    full_tokens = estimate_tokens(full_prompt)
+    tokens = estimate_tokens(prompt)
+    logger.debug(
+        f"意圖提取 Prompt：約 {tokens} tokens（完整版 {full_tokens}，節省 {1 - tokens / full_tokens:.0%}），"
+        f"{len(examples)} 個範例、{len(sections)} 個同義詞分類"
+    )
+    return prompt
+
+
+# 意圖提取回應的 JSON Schema（EXTRACT_FORMAT=schema 時傳給 Ollama 的 format）
+EXTRACT_INFO_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "num_people": {"type": ["integer", "null"]},
+        "preferences": {"type": "array", "items": {"type": "string"}},
+        "want_menu": {"type": "boolean"}
+    },
+    "required": ["num_people", "preferences", "want_menu"]
+}
+
+# 意圖提取的停止序列：模型開始自己接著寫範例時就停止
+EXTRACT_INFO_STOP = ["\n\n\n", "輸入：", "現在處理："]
@@ -4,18 +4,31 @@ KFC 優惠券爬蟲模組
 直接呼叫 KFC API 取得優惠券資料，並使用 LLM 解析
 """
 
+import re
 import json
+import math
+import sqlite3
+import hashlib
+import threading
 import requests
 import os
+import time
 import logging
-from typing import List, Dict, Optional
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Dict, Optional, Tuple
 from datetime import datetime, timedelta
-from pathlib import Path
+from requests.adapters import HTTPAdapter
 from config.config import config
-from src.utils import call_llm
+from src.utils import call_llm, estimate_tokens, write_json_atomic, SingleFlight
+from src.intent_rules import FOOD_LEXICON
 
 logger = logging.getLogger(__name__)
 
+try:
+    from PIL import Image
+except ImportError:  # Pillow 為可選套件，沒有安裝時不產生縮圖
+    Image = None
+
 # KFC API 設定
 KFC_COUPONS_API_URL = "https://olo-api.kfcclub.com.tw/menu/v1/QueryCoupons"
 
@@ -30,6 +43,99 @@ HEADERS = {
 # 資料檔案路徑
 RAW_DATA_FILE = "data/raw.json"
 PARSED_DATA_FILE = "data/coupons.json"
+PARSE_CACHE_FILE = "data/parse_cache.json"
+COUPON_DB_FILE = "data/coupons.db"
+CATALOG_META_FILE = "data/coupons.meta.json"
+CHECKPOINT_FILE = "data/parse_checkpoint.jsonl"
+
+# 解析結果的格式版本（欄位或規則解析的結果有不相容的改動時請遞增）
+CATALOG_SCHEMA_VERSION = 2
+
+# 解析 Prompt 版本（修改 parse_coupon_with_llm 的 Prompt 時請一併遞增，讓舊快取失效）
+PARSE_PROMPT_VERSION = "1"
+
+# 從 LLM 解析結果中快取的欄位
+PARSED_FIELDS = ("name", "items", "serves", "description")
+
+# 單張優惠券解析 Prompt
+PARSE_PROMPT = """請分析以下肯德基優惠券資訊，提取結構化資料。
+
+優惠券描述：「{items_raw}」
+優惠價格：{price}元
+
+請提取以下資訊：
+1. name：優惠券名稱（簡短，例如「炸雞桶 299元」）
+2. items：包含的食物品項（陣列，例如 ["炸雞", "漢堡", "薯條"]）
+3. serves：適合幾人用餐（整數，根據份量推測）
+4. description：完整描述（保留原文或稍微精簡）
+
+只回傳 JSON 格式，不要其他文字：
+{{
+  "name": "...",
+  "items": ["...", "..."],
+  "serves": 數字,
+  "description": "..."
+}}
+
+範例：
+輸入：「9塊香酥炸雞桶，適合全家享用」，價格 299
+輸出：{{"name": "炸雞桶 299元", "items": ["炸雞"], "serves": 3, "description": "9塊香酥炸雞桶"}}
+
+現在處理：
+"""
+
+# 多張優惠券批次解析 Prompt（說明與範例只送一次）
+BATCH_PARSE_PROMPT = """請分析以下 {count} 張肯德基優惠券資訊，逐張提取結構化資料。
+
+{coupon_lines}
+
+每張優惠券請提取：
+1. code：優惠券代號（照抄上面的 code，用來對應）
+2. name：優惠券名稱（簡短，例如「炸雞桶 299元」）
+3. items：包含的食物品項（陣列，例如 ["炸雞", "漢堡", "薯條"]）
+4. serves：適合幾人用餐（整數，根據份量推測）
+5. description：完整描述（保留原文或稍微精簡）
+
+只回傳 JSON 陣列，每張優惠券一個物件，不要其他文字：
+[
+  {{"code": "...", "name": "...", "items": ["...", "..."], "serves": 數字, "description": "..."}}
+]
+
+範例：
+輸入：code: A01｜描述：「9塊香酥炸雞桶，適合全家享用」｜價格：299元
+輸出：[{{"code": "A01", "name": "炸雞桶 299元", "items": ["炸雞"], "serves": 3, "description": "9塊香酥炸雞桶"}}]
+
+現在處理：
+"""
+
+
+class ParseStats:
+    """優惠券解析統計（可在多個 worker 之間共用）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = {
+            "llm_calls": 0,        # LLM 請求次數
+            "llm_coupons": 0,      # 送進 LLM 的優惠券次數（批次缺漏重送會重複計算）
+            "prompt_tokens": 0,    # 估算的 prompt token 總數
+            "batch_fallbacks": 0,  # 批次回應缺漏、改走單張解析的優惠券數
+            "rule_hits": 0,        # 由規則解析器直接處理（省下 LLM 呼叫）的優惠券數
+        }
+
+    def add(self, **kwargs):
+        """累加計數"""
+        with self._lock:
+            for name, value in kwargs.items():
+                self.counts[name] = self.counts.get(name, 0) + value
+
+    def snapshot(self) -> Dict[str, int]:
+        """取得目前計數的副本"""
+        with self._lock:
+            return dict(self.counts)
+
+
+# 最近一次 parse_all_coupons 的統計
+last_parse_stats = ParseStats()
 
 
 def fetch_raw() -> dict:
@@ -86,7 +192,266 @@ def to_raw_schema(payload: dict) -> List[Dict]:
     return coupons
 
 
-def parse_coupon_with_llm(raw_coupon: Dict) -> Optional[Dict]:
+def _build_coupon(raw_coupon: Dict, parsed: Dict, source: str = "llm") -> Dict:
+    """
+    合併原始資料與解析結果
+
+    參數：
+        raw_coupon: 原始優惠券資料
+        parsed: 解析出的 name/items/serves/description
+        source: 解析路徑（rules / cache / llm / llm_batch）
+
+    回傳：
+        完整的優惠券資料
+    """
+    return {
+        "id": raw_coupon.get("code"),
+        "name": parsed.get("name"),
+        "price": raw_coupon.get("price", 0),
+        "items": parsed.get("items", []),
+        "serves": parsed.get("serves", 1),
+        "description": parsed.get("description", raw_coupon.get("items_raw", "")),
+        # 保留原始資料
+        "fcode": raw_coupon.get("fcode"),
+        "category": raw_coupon.get("category"),
+        "img": raw_coupon.get("img"),
+        # 記錄由哪條路徑解析
+        "parse_source": source,
+    }
+
+
+def parse_cache_key(raw_coupon: Dict, model: Optional[str] = None) -> str:
+    """
+    計算優惠券解析快取的 key
+
+    以 (items_raw, price, Prompt 版本, 模型) 的雜湊作為 key，
+    任一項改變都會視為新的優惠券重新解析。
+
+    參數：
+        raw_coupon: 原始優惠券資料
+        model: 使用的模型（預設用配置檔的）
+
+    回傳：
+        sha256 十六進位字串
+    """
+    if model is None:
+        model = config.OLLAMA_MODEL
+
+    material = json.dumps(
+        [raw_coupon.get("items_raw", ""), raw_coupon.get("price", 0), PARSE_PROMPT_VERSION, model],
+        ensure_ascii=False
+    )
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+def load_parse_cache() -> Dict[str, Dict]:
+    """
+    載入優惠券解析快取
+
+    回傳：
+        {cache_key: {name, items, serves, description}}，檔案不存在或損壞則回傳空 dict
+    """
+    if not os.path.exists(PARSE_CACHE_FILE):
+        return {}
+
+    try:
+        with open(PARSE_CACHE_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception as e:
+        logger.error(f"載入解析快取失敗：{e}")
+        return {}
+
+
+def save_parse_cache(cache: Dict[str, Dict]):
+    """
+    儲存優惠券解析快取
+
+    參數：
+        cache: {cache_key: {name, items, serves, description}}
+    """
+    write_json_atomic(PARSE_CACHE_FILE, cache)
+    logger.info(f"已儲存解析快取：{PARSE_CACHE_FILE}（{len(cache)} 筆）")
+
+
+# ========== 規則解析（fast path） ==========
+
+# 品項分隔符號
+ITEM_SEPARATORS = re.compile(r"[+＋、,，/]")
+
+# 單一品項：「(數量)名稱(尺寸)(x數量 或 N塊)」
+ITEM_PATTERN = re.compile(
+    r"^(?:(?P<prefix_qty>\d+)(?:塊|顆|個|份|杯|入))?"
+    r"(?P<name>[^()（）\dxX×*＊]+?)"
+    r"\s*(?:[(（](?P<size>[^)）]*)[)）])?"
+    r"\s*(?:[xX×*＊]\s*(?P<qty>\d+)|(?P<pieces>\d+)\s*(?:塊|顆|個|份|杯|入))?$"
+)
+
+# 品項關鍵字 → (類別, 通用名稱)（依序比對，先比對較具體的關鍵字）
+# 通用名稱與 PARSE_PROMPT 要求 LLM 輸出的品項（「炸雞」「漢堡」「薯條」）一致，使用者偏好也會正規化成這些名稱
+ITEM_LEXICON = [
+    ("堡", "burger", "漢堡"),
+    ("捲", "burger", "捲餅"),
+    ("雞塊", "nugget", "雞塊"),
+    ("雞米花", "nugget", "雞米花"),
+    ("蛋撻", "dessert", "蛋撻"),
+    ("蛋塔", "dessert", "蛋撻"),
+    ("QQ球", "dessert", "QQ球"),
+    ("冰淇淋", "dessert", "冰淇淋"),
+    ("聖代", "dessert", "聖代"),
+    ("派", "dessert", "派"),
+    ("可樂", "drink", "可樂"),
+    ("七喜", "drink", "汽水"),
+    ("汽水", "drink", "汽水"),
+    ("茶", "drink", "茶"),
+    ("咖啡", "drink", "咖啡"),
+    ("果汁", "drink", "果汁"),
+    ("薯", "side", "薯條"),
+    ("玉米", "side", "玉米"),
+    ("沙拉", "side", "沙拉"),
+    ("湯", "side", "湯"),
+    ("麵", "side", "麵"),
+    ("飯", "side", "飯"),
+    ("雞", "chicken", "炸雞"),
+]
+
+# 主餐類別（決定名稱與人數）
+MAIN_CATEGORIES = ("burger", "chicken", "nugget")
+
+# 炸雞每人幾塊（與 PARSE_PROMPT 範例一致：「9塊香酥炸雞桶」→ 3 人）
+CHICKEN_PIECES_PER_PERSON = 3
+
+
+def _classify_item(name: str) -> Optional[Tuple[str, str]]:
+    """依關鍵字判斷品項類別，回傳 (類別, 通用名稱)，無法辨識則回傳 None"""
+    for keyword, category, generic in ITEM_LEXICON:
+        if keyword in name:
+            return category, generic
+    return None
+
+
+def _item_names(name: str, generic: str) -> List[str]:
+    """
+    品項要放進 items 的名稱：通用名稱，加上使用者偏好會用到的較具體名稱
+
+    例如「咔啦雞腿堡」→ ["漢堡"]、「香酥脆薯」→ ["薯條", "香酥脆薯"]、「辣脆雞」→ ["炸雞", "辣脆雞"]
+    """
+    names = [generic]
+    lowered = name.lower()
+    for phrase, canonical in FOOD_LEXICON:
+        if phrase in lowered:
+            if canonical not in names:
+                names.append(canonical)
+            break
+    return names
+
+
+def parse_coupon_with_rules(raw_coupon: Dict):
+    """
+    使用規則解析常見格式的優惠券描述
+
+    處理「咔啦雞腿堡x1+上校雞塊4塊+香酥脆薯(中)x1+百事可樂(中)x1」這類以分隔符號
+    串接的品項，依關鍵字辨識類別並推算適合人數。品項使用與 LLM 解析相同的通用名稱
+    （「漢堡」「雞塊」「薯條」「可樂」），原始名稱保留在 description。
+
+    參數：
+        raw_coupon: 原始優惠券資料
+
+    回傳：
+        (解析後的優惠券資料, 信心分數 0.0-1.0)，完全無法解析則回傳 (None, 0.0)
+    """
+    items_raw = raw_coupon.get("items_raw", "")
+    price = raw_coupon.get("price", 0)
+
+    pieces = [piece.strip() for piece in ITEM_SEPARATORS.split(items_raw) if piece.strip()]
+    if not pieces:
+        return None, 0.0
+
+    items = []
+    counts = {"burger": 0, "chicken": 0, "nugget": 0, "drink": 0}
+    main_items = []
+    recognized = 0
+
+    for piece in pieces:
+        match = ITEM_PATTERN.match(piece)
+        if not match:
+            items.append(piece)
+            continue
+
+        name = match.group("name").strip()
+        classified = _classify_item(name)
+        if classified is None:
+            items.append(name)
+            continue
+
+        category, generic = classified
+        recognized += 1
+        quantity = int(match.group("qty") or 1)
+        pieces_count = int(match.group("pieces") or match.group("prefix_qty") or 0)
+
+        for item in _item_names(name, generic):
+            if item not in items:
+                items.append(item)
+        if category in MAIN_CATEGORIES and name not in main_items:
+            main_items.append(name)
+
+        if category == "chicken":
+            counts["chicken"] += (pieces_count or 1) * quantity
+        elif category in counts:
+            counts[category] += quantity
+
+    confidence = recognized / len(pieces)
+    if not main_items:
+        # 沒有主餐時人數很難推測，降低信心
+        confidence *= 0.5
+
+    # 推算人數：有飲料時以飲料杯數為準（套餐通常一人一杯），否則以主餐份量估算
+    if counts["drink"]:
+        serves = max(counts["drink"], counts["burger"])
+    else:
+        serves = counts["burger"] + math.ceil(counts["chicken"] / CHICKEN_PIECES_PER_PERSON)
+    serves = max(1, serves)
+
+    if main_items:
+        name = f"{main_items[0]}{'套餐' if len(pieces) > 1 else ''} {price}元"
+    else:
+        name = f"{items[0]} {price}元"
+
+    parsed = {
+        "name": name,
+        "items": items,
+        "serves": serves,
+        "description": items_raw,
+    }
+    return _build_coupon(raw_coupon, parsed, source="rules"), confidence
+
+
+# 規則解析回歸測試：(描述, 預期 items, 預期 serves)，與 LLM 解析的輸出一致
+RULE_PARSE_REGRESSION_CASES = [
+    ("9塊香酥炸雞桶", ["炸雞"], 3),  # PARSE_PROMPT 的範例
+    ("咔啦雞腿堡x1+上校雞塊4塊+香酥脆薯(中)x1+百事可樂(中)x1", ["漢堡", "雞塊", "薯條", "香酥脆薯", "可樂"], 1),
+    ("咔啦脆雞2塊+蛋撻x2+百事可樂(中)x2", ["炸雞", "蛋撻", "可樂"], 2),
+]
+
+
+def check_rule_parser() -> int:
+    """
+    執行規則解析回歸測試並印出結果
+
+    回傳：
+        失敗的案例數
+    """
+    failures = 0
+    for items_raw, expected_items, expected_serves in RULE_PARSE_REGRESSION_CASES:
+        coupon, _ = parse_coupon_with_rules({"code": "TEST", "items_raw": items_raw, "price": 0})
+        actual = (coupon["items"], coupon["serves"]) if coupon else None
+        ok = actual == (expected_items, expected_serves)
+        failures += not ok
+        print(f"{'✅' if ok else '❌'} 「{items_raw}」→ {actual}"
+              + ("" if ok else f"（預期 {(expected_items, expected_serves)}）"))
+    return failures
+
+
+def parse_coupon_with_llm(raw_coupon: Dict, stats: Optional[ParseStats] = None) -> Optional[Dict]:
     """
     使用 LLM 解析優惠券資訊
 
@@ -99,6 +464,7 @@ def parse_coupon_with_llm(raw_coupon: Dict) -> Optional[Dict]:
 
     參數：
         raw_coupon: 原始優惠券資料
+        stats: 解析統計（可選，記錄 LLM 呼叫次數與 prompt token 數）
 
     回傳：
         解析後的優惠券資料，失敗則回傳 None
@@ -111,31 +477,9 @@ def parse_coupon_with_llm(raw_coupon: Dict) -> Optional[Dict]:
         return None
 
     # 構建 Prompt
-    prompt = f"""請分析以下肯德基優惠券資訊，提取結構化資料。
-
-優惠券描述：「{items_raw}」
-優惠價格：{price}元
-
-請提取以下資訊：
-1. name：優惠券名稱（簡短，例如「炸雞桶 299元」）
-2. items：包含的食物品項（陣列，例如 ["炸雞", "漢堡", "薯條"]）
-3. serves：適合幾人用餐（整數，根據份量推測）
-4. description：完整描述（保留原文或稍微精簡）
-
-只回傳 JSON 格式，不要其他文字：
-{{
-  "name": "...",
-  "items": ["...", "..."],
-  "serves": 數字,
-  "description": "..."
-}}
-
-範例：
-輸入：「9塊香酥炸雞桶，適合全家享用」，價格 299
-輸出：{{"name": "炸雞桶 299元", "items": ["炸雞"], "serves": 3, "description": "9塊香酥炸雞桶"}}
-
-現在處理：
-"""
+    prompt = PARSE_PROMPT.format(items_raw=items_raw, price=price)
+    if stats is not None:
+        stats.add(llm_calls=1, llm_coupons=1, prompt_tokens=estimate_tokens(prompt))
 
     logger.debug(f"正在解析優惠券：{raw_coupon.get('code')}")
 
@@ -153,18 +497,7 @@ def parse_coupon_with_llm(raw_coupon: Dict) -> Optional[Dict]:
         parsed = json.loads(response)
 
         # 合併資料
-        result = {
-            "id": raw_coupon.get("code"),
-            "name": parsed.get("name"),
-            "price": price,
-            "items": parsed.get("items", []),
-            "serves": parsed.get("serves", 1),
-            "description": parsed.get("description", items_raw),
-            # 保留原始資料
-            "fcode": raw_coupon.get("fcode"),
-            "category": raw_coupon.get("category"),
-            "img": raw_coupon.get("img"),
-        }
+        result = _build_coupon(raw_coupon, parsed)
 
         logger.debug(f"解析成功：{result['name']}")
         return result
@@ -174,12 +507,146 @@ def parse_coupon_with_llm(raw_coupon: Dict) -> Optional[Dict]:
         return None
 
 
+def _extract_json_array(response: str) -> Optional[list]:
+    """
+    從 LLM 回應中取出 JSON 陣列（容忍 markdown 標記與前後多餘文字）
+
+    參數：
+        response: LLM 回應文字
+
+    回傳：
+        解析出的 list，失敗則回傳 None
+    """
+    response = response.replace("```json", "").replace("```", "").strip()
+    start = response.find("[")
+    end = response.rfind("]")
+    if start == -1 or end <= start:
+        return None
+
+    try:
+        parsed = json.loads(response[start:end + 1])
+    except json.JSONDecodeError:
+        return None
+
+    return parsed if isinstance(parsed, list) else None
+
+
+def parse_coupons_batch_with_llm(
+    raw_coupons: List[Dict],
+    stats: Optional[ParseStats] = None
+) -> Dict[str, Dict]:
+    """
+    使用一次 LLM 請求解析多張優惠券
+
+    LLM 回傳以 code 對應的 JSON 陣列；缺漏或格式錯誤的優惠券不會出現在回傳值中，
+    由呼叫端決定是否改走單張解析。
+
+    參數：
+        raw_coupons: 原始優惠券列表（需有 code 與 items_raw）
+        stats: 解析統計（可選）
+
+    回傳：
+        {code: 解析後的優惠券資料}
+    """
+    by_code = {str(raw_coupon.get("code")): raw_coupon for raw_coupon in raw_coupons}
+
+    coupon_lines = "\n".join(
+        f"- code: {code}｜描述：「{raw_coupon.get('items_raw', '')}」｜價格：{raw_coupon.get('price', 0)}元"
+        for code, raw_coupon in by_code.items()
+    )
+    prompt = BATCH_PARSE_PROMPT.format(count=len(by_code), coupon_lines=coupon_lines)
+    if stats is not None:
+        stats.add(llm_calls=1, llm_coupons=len(by_code), prompt_tokens=estimate_tokens(prompt))
+
+    logger.debug(f"正在批次解析優惠券：{', '.join(by_code)}")
+
+    response = call_llm(prompt, temperature=0.3, max_tokens=300 * len(by_code))
+
+    if not response:
+        logger.error(f"LLM 批次解析失敗：{', '.join(by_code)}")
+        return {}
+
+    rows = _extract_json_array(response)
+    if rows is None:
+        logger.error(f"批次 JSON 解析失敗：{response}")
+        return {}
+
+    results = {}
+    for row in rows:
+        if not isinstance(row, dict):
+            continue
+        code = str(row.get("code"))
+        if code not in by_code or code in results:
+            continue
+        if not row.get("name") or not isinstance(row.get("items"), list):
+            continue
+        results[code] = _build_coupon(by_code[code], row, source="llm_batch")
+
+    return results
+
+
+def fingerprint_raw_coupons(raw_coupons: List[Dict]) -> str:
+    """
+    計算正規化後原始優惠券的指紋
+
+    參數：
+        raw_coupons: to_raw_schema 產生的原始優惠券列表
+
+    回傳：
+        sha256 十六進位字串
+    """
+    material = json.dumps(raw_coupons, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+def load_raw_coupons() -> Optional[List[Dict]]:
+    """
+    載入上次儲存的原始優惠券資料
+
+    回傳：
+        原始優惠券列表，檔案不存在或損壞則回傳 None
+    """
+    if not os.path.exists(RAW_DATA_FILE):
+        return None
+
+    try:
+        with open(RAW_DATA_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception as e:
+        logger.error(f"載入原始資料失敗：{e}")
+        return None
+
+
+def diff_raw_coupons(old_coupons: List[Dict], new_coupons: List[Dict]) -> Dict[str, List[str]]:
+    """
+    比較兩份原始優惠券資料（以 code 對應）
+
+    參數：
+        old_coupons: 舊的原始優惠券列表
+        new_coupons: 新的原始優惠券列表
+
+    回傳：
+        {"added": [...], "removed": [...], "changed": [...]}，內容為優惠券代號
+    """
+    old_by_code = {coupon.get("code"): coupon for coupon in old_coupons}
+    new_by_code = {coupon.get("code"): coupon for coupon in new_coupons}
+
+    return {
+        "added": [code for code in new_by_code if code not in old_by_code],
+        "removed": [code for code in old_by_code if code not in new_by_code],
+        "changed": [
+            code for code, coupon in new_by_code.items()
+            if code in old_by_code and old_by_code[code] != coupon
+        ],
+    }
+
+
 def get_raw_coupons(save_to_file: bool = True) -> List[Dict]:
     """
     取得原始優惠券資料
 
     參數：
-        save_to_file: 是否儲存到檔案
+        save_to_file: 是否儲存到檔案（內容與上次相同時不會重寫）
 
     回傳：
         原始優惠券列表
@@ -194,104 +661,723 @@ def get_raw_coupons(save_to_file: bool = True) -> List[Dict]:
     coupons = to_raw_schema(payload)
 
     if save_to_file:
-        os.makedirs("data", exist_ok=True)
-        with open(RAW_DATA_FILE, "w", encoding="utf-8") as f:
-            json.dump(coupons, f, ensure_ascii=False, indent=2)
-        logger.info(f"已儲存原始資料：{RAW_DATA_FILE}")
+        previous = load_raw_coupons()
+        if previous is not None and fingerprint_raw_coupons(previous) == fingerprint_raw_coupons(coupons):
+            logger.info(f"原始資料沒有變動，略過寫入：{RAW_DATA_FILE}")
+        else:
+            write_json_atomic(RAW_DATA_FILE, coupons)
+            logger.info(f"已儲存原始資料：{RAW_DATA_FILE}")
 
     return coupons
 
 
-def parse_all_coupons(raw_coupons: List[Dict]) -> List[Dict]:
+def _safe_parse_coupon(raw_coupon: Dict, stats: Optional[ParseStats] = None) -> Optional[Dict]:
+    """
+    解析單張優惠券，把例外隔離在這張優惠券內
+
+    參數：
+        raw_coupon: 原始優惠券資料
+        stats: 解析統計（可選）
+
+    回傳：
+        解析後的優惠券資料，失敗則回傳 None
+    """
+    try:
+        return parse_coupon_with_llm(raw_coupon, stats)
+    except Exception as e:
+        logger.error(f"解析優惠券時發生例外 ({raw_coupon.get('code')}): {e}")
+        return None
+
+
+def _parse_chunk(raw_coupons: List[Dict], stats: ParseStats) -> List[Optional[Dict]]:
+    """
+    解析一組優惠券：先批次解析，缺漏的再逐張解析
+
+    參數：
+        raw_coupons: 原始優惠券列表
+        stats: 解析統計
+
+    回傳：
+        與輸入順序對應的解析結果（失敗為 None）
+    """
+    codes = [str(raw_coupon.get("code")) for raw_coupon in raw_coupons]
+    # 沒有描述文字的優惠券交給單張解析處理（會直接跳過）
+    candidates = [raw_coupon for raw_coupon in raw_coupons if raw_coupon.get("items_raw")]
+    batchable = len(candidates) > 1 and len(set(codes)) == len(codes)
+
+    batch_results = {}
+    if batchable:
+        try:
+            batch_results = parse_coupons_batch_with_llm(candidates, stats)
+        except Exception as e:
+            logger.error(f"批次解析時發生例外：{e}")
+
+    results = []
+    for code, raw_coupon in zip(codes, raw_coupons):
+        if code in batch_results:
+            results.append(batch_results[code])
+            continue
+        if batchable and raw_coupon.get("items_raw"):
+            stats.add(batch_fallbacks=1)
+        results.append(_safe_parse_coupon(raw_coupon, stats))
+
+    return results
+
+
+def iter_parse_coupons(
+    raw_coupons: List[Dict],
+    max_workers: Optional[int] = None,
+    use_cache: bool = True,
+    batch_size: Optional[int] = None,
+    use_rules: Optional[bool] = None,
+    resume: Optional[Dict[str, Dict]] = None,
+    stats: Optional[ParseStats] = None
+):
+    """
+    逐張產出優惠券解析結果（串流版本的 parse_all_coupons）
+
+    依序嘗試：解析快取 → checkpoint → 規則解析 → LLM（批次 + thread pool）。
+    每張優惠券完成時立即 yield，順序為完成順序而非輸入順序；
+    中途中斷（例外、Ctrl-C、停止迭代）時會取消尚未開始的請求，已完成的結果仍會寫入解析快取。
+
+    參數：
+        raw_coupons: 原始優惠券列表
+        max_workers: 並行 worker 數（預設用配置檔的 PARSE_WORKERS，1 表示逐批解析）
+        use_cache: 是否使用解析快取
+        batch_size: 每次請求打包的優惠券數（預設用配置檔的 PARSE_BATCH_SIZE）
+        use_rules: 是否先用規則解析（預設用配置檔的 RULE_PARSER_ENABLED）
+        resume: 上次中斷時的 checkpoint（{cache_key: {name, items, serves, description}}）
+        stats: 解析統計（可選）
+
+    產出：
+        (index, 解析結果或 None)
+    """
+    if stats is None:
+        stats = ParseStats()
+    resume = resume or {}
+
+    # 查詢解析快取與 checkpoint
+    cache = load_parse_cache() if use_cache else {}
+    keys = [parse_cache_key(raw_coupon) for raw_coupon in raw_coupons]
+    new_entries = {}
+    pending = []
+
+    for i, (raw_coupon, key) in enumerate(zip(raw_coupons, keys)):
+        if key in cache:
+            yield i, _build_coupon(raw_coupon, cache[key], source="cache")
+        elif key in resume:
+            new_entries[key] = resume[key]
+            yield i, _build_coupon(raw_coupon, resume[key], source="checkpoint")
+        else:
+            pending.append(i)
+    reused = len(raw_coupons) - len(pending)
+
+    # 規則解析（信心足夠就不送 LLM）
+    if use_rules is None:
+        use_rules = config.RULE_PARSER_ENABLED
+    if use_rules:
+        remaining = []
+        for i in pending:
+            try:
+                result, confidence = parse_coupon_with_rules(raw_coupons[i])
+            except Exception as e:
+                logger.error(f"規則解析時發生例外 ({raw_coupons[i].get('code')}): {e}")
+                result, confidence = None, 0.0
+            if result and confidence >= config.RULE_PARSER_MIN_CONFIDENCE:
+                stats.add(rule_hits=1)
+                yield i, result
+            else:
+                remaining.append(i)
+        pending = remaining
+
+    # 切成批次
+    if batch_size is None:
+        batch_size = config.PARSE_BATCH_SIZE
+    batch_size = max(1, batch_size)
+    chunks = [pending[i:i + batch_size] for i in range(0, len(pending), batch_size)]
+
+    if max_workers is None:
+        max_workers = config.PARSE_WORKERS
+    max_workers = max(1, min(max_workers, len(chunks) or 1))
+
+    logger.info(
+        f"開始解析 {len(raw_coupons)} 張優惠券（快取/checkpoint 命中 {reused} 張，"
+        f"規則解析 {stats.snapshot()['rule_hits']} 張，"
+        f"需呼叫 LLM {len(pending)} 張，batch={batch_size}，workers={max_workers}）..."
+    )
+
+    def record(i, result):
+        if result:
+            new_entries[keys[i]] = {field: result[field] for field in PARSED_FIELDS}
+
+    done = 0
+    executor = None
+    try:
+        if max_workers == 1:
+            for chunk in chunks:
+                chunk_results = _parse_chunk([raw_coupons[i] for i in chunk], stats)
+                done += len(chunk)
+                logger.info(f"進度：{done}/{len(pending)}")
+                for i, result in zip(chunk, chunk_results):
+                    record(i, result)
+                    yield i, result
+        else:
+            executor = ThreadPoolExecutor(max_workers=max_workers)
+            futures = {
+                executor.submit(_parse_chunk, [raw_coupons[i] for i in chunk], stats): chunk
+                for chunk in chunks
+            }
+            # 進度在主執行緒回報（Streamlit 的 UI 只能在主執行緒更新）
+            for future in as_completed(futures):
+                chunk = futures[future]
+                chunk_results = future.result()
+                done += len(chunk)
+                logger.info(f"進度：{done}/{len(pending)}")
+                for i, result in zip(chunk, chunk_results):
+                    record(i, result)
+                    yield i, result
+    finally:
+        if executor is not None:
+            # 中斷時不再等待尚未開始的請求
+            executor.shutdown(wait=done >= len(pending), cancel_futures=True)
+
+        # 更新解析快取（中斷時也保留已完成的結果）
+        if use_cache and new_entries:
+            cache.update(new_entries)
+            save_parse_cache(cache)
+
+
+def parse_all_coupons(
+    raw_coupons: List[Dict],
+    max_workers: Optional[int] = None,
+    use_cache: bool = True,
+    batch_size: Optional[int] = None,
+    use_rules: Optional[bool] = None,
+    resume: Optional[Dict[str, Dict]] = None,
+    on_result=None
+) -> List[Dict]:
     """
-    使用 LLM 解析所有優惠券
+    解析所有優惠券
+
+    先查詢解析快取，再用規則解析常見格式，只有規則沒把握的新優惠券才會送給 LLM；
+    這些優惠券每 batch_size 張打包成一次請求，以 thread pool 同時送出，
+    結果仍維持輸入順序，單張優惠券失敗只會被跳過，不影響其他優惠券。
 
     參數：
         raw_coupons: 原始優惠券列表
+        max_workers: 並行 worker 數（預設用配置檔的 PARSE_WORKERS，1 表示逐批解析）
+        use_cache: 是否使用解析快取
+        batch_size: 每次請求打包的優惠券數（預設用配置檔的 PARSE_BATCH_SIZE）
+        use_rules: 是否先用規則解析（預設用配置檔的 RULE_PARSER_ENABLED）
+        resume: 上次中斷時的 checkpoint（見 load_checkpoint）
+        on_result: 每張優惠券完成時的回呼 on_result(raw_coupon, result)（在主執行緒呼叫）
 
     回傳：
         解析後的優惠券列表
     """
-    logger.info(f"開始解析 {len(raw_coupons)} 張優惠券...")
+    global last_parse_stats
 
-    parsed = []
-    failed = 0
+    results: List[Optional[Dict]] = [None] * len(raw_coupons)
+    stats = ParseStats()
+    start = time.perf_counter()
 
-    for i, raw_coupon in enumerate(raw_coupons, 1):
-        logger.info(f"進度：{i}/{len(raw_coupons)}")
+    for i, result in iter_parse_coupons(
+        raw_coupons, max_workers, use_cache, batch_size, use_rules, resume, stats
+    ):
+        results[i] = result
+        if on_result:
+            on_result(raw_coupons[i], result)
 
-        result = parse_coupon_with_llm(raw_coupon)
+    parsed = []
+    failed = 0
 
+    for raw_coupon, result in zip(raw_coupons, results):
         if result:
             parsed.append(result)
         else:
             failed += 1
             logger.warning(f"跳過優惠券：{raw_coupon.get('code')}")
 
-    logger.info(f"解析完成：成功 {len(parsed)} 張，失敗 {failed} 張")
+    elapsed = time.perf_counter() - start
+    counts = stats.snapshot()
+    tokens_per_coupon = counts["prompt_tokens"] / counts["llm_coupons"] if counts["llm_coupons"] else 0
+    logger.info(f"解析完成：成功 {len(parsed)} 張，失敗 {failed} 張（耗時 {elapsed:.1f} 秒）")
+    logger.info(
+        f"LLM 請求 {counts['llm_calls']} 次，prompt 約 {counts['prompt_tokens']} tokens"
+        f"（每張約 {tokens_per_coupon:.0f}），批次缺漏改單張 {counts['batch_fallbacks']} 張"
+    )
+    last_parse_stats = stats
 
     return parsed
 
 
-def scrape_and_parse(force_update: bool = False) -> List[Dict]:
+# ========== 解析 checkpoint ==========
+
+def load_checkpoint() -> Dict[str, Dict]:
     """
-    完整的爬取與解析流程
+    載入上次中斷時留下的解析 checkpoint
+
+    回傳：
+        {cache_key: {name, items, serves, description}}，沒有 checkpoint 則回傳空 dict
+    """
+    if not os.path.exists(CHECKPOINT_FILE):
+        return {}
+
+    entries = {}
+    with open(CHECKPOINT_FILE, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+                entries[entry["key"]] = entry["parsed"]
+            except (json.JSONDecodeError, KeyError, TypeError):
+                # 最後一行可能在寫入時被中斷
+                continue
+
+    if entries:
+        logger.info(f"找到上次中斷的 checkpoint：{len(entries)} 張已解析")
+    return entries
+
+
+def _append_checkpoint(f, raw_coupon: Dict, result: Dict):
+    """把一張剛解析完的優惠券追加到 checkpoint"""
+    entry = {
+        "key": parse_cache_key(raw_coupon),
+        "parsed": {field: result[field] for field in PARSED_FIELDS},
+    }
+    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    f.flush()
+
+
+def clear_checkpoint():
+    """成功儲存後刪除 checkpoint"""
+    if os.path.exists(CHECKPOINT_FILE):
+        os.remove(CHECKPOINT_FILE)
+
+
+def _fetch_stage(previous: Optional[Dict]):
+    """
+    階段 1-2：抓取 KFC API 並正規化，與上一輪比對差異
 
     參數：
-        force_update: 是否強制重新爬取
+        previous: 上一輪的解析結果（_load_parsed_data）
 
     回傳：
-        解析後的優惠券列表
+        (raw_coupons, fingerprint, reusable)，reusable 為不需重新解析的 {code: 優惠券}；
+        原始資料完全沒變、且上次每張都解析成功時 reusable 為 None
     """
-    # 檢查是否有快取
-    if not force_update and os.path.exists(PARSED_DATA_FILE):
-        logger.info(f"從快取載入：{PARSED_DATA_FILE}")
-        with open(PARSED_DATA_FILE, "r", encoding="utf-8") as f:
-            data = json.load(f)
-            logger.info(f"載入 {len(data['coupons'])} 張優惠券（最後更新：{data['last_updated']}）")
-            return data["coupons"]
+    previous_raw = load_raw_coupons()
 
-    # 爬取原始資料
     logger.info("開始爬取優惠券...")
     raw_coupons = get_raw_coupons()
+    fingerprint = fingerprint_raw_coupons(raw_coupons)
+
+    # 舊格式版本的解析結果不沿用（例如規則解析的品項名稱改變）
+    if previous and previous.get("schema_version") != CATALOG_SCHEMA_VERSION:
+        previous = None
+
+    if previous and previous.get("fingerprint") == fingerprint:
+        # 上一輪解析失敗的優惠券不在結果中，要重新解析，不能直接沿用
+        reusable = {coupon.get("id"): coupon for coupon in previous["coupons"]}
+        missing = [
+            raw_coupon.get("code") for raw_coupon in raw_coupons
+            if raw_coupon.get("code") not in reusable
+        ]
+        if not missing:
+            return raw_coupons, fingerprint, None
+
+        logger.info(f"原始資料沒有變動，但有 {len(missing)} 張上次解析失敗，重新解析")
+        return raw_coupons, fingerprint, reusable
+
+    # 只有 raw.json 與解析結果是同一輪產生的，才能以 raw.json 當作比對基準
+    reusable = {}
+    if previous and previous_raw is not None \
+            and previous.get("fingerprint") == fingerprint_raw_coupons(previous_raw):
+        diff = diff_raw_coupons(previous_raw, raw_coupons)
+        logger.info(
+            f"原始資料差異：新增 {len(diff['added'])} 張，移除 {len(diff['removed'])} 張，"
+            f"變動 {len(diff['changed'])} 張"
+        )
+        dirty = set(diff["added"]) | set(diff["changed"])
+        reusable = {
+            coupon.get("id"): coupon for coupon in previous["coupons"]
+            if coupon.get("id") not in dirty
+        }
+
+    return raw_coupons, fingerprint, reusable
+
+
+def _parse_stage(raw_coupons: List[Dict], reusable: Dict[str, Dict]) -> List[Dict]:
+    """
+    階段 3：解析差異部分，每完成一張就追加到 checkpoint
+
+    參數：
+        raw_coupons: 原始優惠券列表
+        reusable: 可沿用的 {code: 優惠券}
+
+    回傳：
+        依原始順序排列的優惠券列表
+    """
+    to_parse = [raw_coupon for raw_coupon in raw_coupons if raw_coupon.get("code") not in reusable]
+    logger.info(f"開始解析差異優惠券（{len(to_parse)} 張，沿用 {len(raw_coupons) - len(to_parse)} 張）...")
+
+    resume = load_checkpoint()
+    os.makedirs(os.path.dirname(CHECKPOINT_FILE) or ".", exist_ok=True)
+
+    with open(CHECKPOINT_FILE, "a", encoding="utf-8") as checkpoint:
+        def on_result(raw_coupon, result):
+            # 快取 / checkpoint / 規則的結果不需要再記錄
+            if result and result.get("parse_source", "").startswith("llm"):
+                _append_checkpoint(checkpoint, raw_coupon, result)
+
+        newly_parsed = {
+            coupon["id"]: coupon
+            for coupon in parse_all_coupons(to_parse, resume=resume, on_result=on_result)
+        }
+
+    # 依原始順序合併
+    parsed_coupons = []
+    for raw_coupon in raw_coupons:
+        code = raw_coupon.get("code")
+        coupon = reusable.get(code) or newly_parsed.get(code)
+        if coupon:
+            parsed_coupons.append(coupon)
+
+    return parsed_coupons
 
-    # 使用 LLM 解析
-    logger.info("開始使用 LLM 解析...")
-    parsed_coupons = parse_all_coupons(raw_coupons)
 
-    # 儲存解析結果
-    os.makedirs("data", exist_ok=True)
+def _persist_stage(parsed_coupons: List[Dict], fingerprint: str):
+    """
+    階段 4：儲存解析結果、清除 checkpoint、下載圖片
+
+    參數：
+        parsed_coupons: 解析後的優惠券列表
+        fingerprint: 原始資料指紋
+    """
     cache_data = {
         "last_updated": datetime.now().isoformat(),
         "count": len(parsed_coupons),
+        "fingerprint": fingerprint,
+        "schema_version": CATALOG_SCHEMA_VERSION,
         "coupons": parsed_coupons
     }
+    save_catalog(cache_data)
+    clear_checkpoint()
 
-    with open(PARSED_DATA_FILE, "w", encoding="utf-8") as f:
-        json.dump(cache_data, f, ensure_ascii=False, indent=2)
+    # 下載圖片到本機（失敗不影響優惠券資料）
+    if config.DOWNLOAD_IMAGES:
+        try:
+            download_coupon_images(parsed_coupons)
+        except Exception as e:
+            logger.error(f"下載優惠券圖片失敗：{e}")
+
+
+# 合併同時觸發的爬取與解析（多個網頁 session 同時啟動時只跑一次）
+_scrape_flight = SingleFlight()
 
-    logger.info(f"已儲存解析結果：{PARSED_DATA_FILE}")
+
+def scrape_and_parse(force_update: bool = False) -> List[Dict]:
+    """
+    完整的爬取與解析流程
+
+    分成 抓取 → 正規化 → 解析 → 儲存 四個階段；解析階段每完成一張就寫入 checkpoint，
+    中途失敗（LLM 逾時、Ctrl-C）後重新執行會從 checkpoint 接續，不必重新解析。
+    同時有多個呼叫（例如多個使用者同時開啟網頁、背景更新）時只會執行一次，其餘共用結果。
+
+    參數：
+        force_update: 是否強制重新爬取
+
+    回傳：
+        解析後的優惠券列表
+    """
+    return _scrape_flight.do(("scrape_and_parse", force_update), lambda: _scrape_and_parse(force_update))
+
+
+def _scrape_and_parse(force_update: bool) -> List[Dict]:
+    # 檢查是否有快取
+    if not force_update:
+        data = _load_parsed_data()
+        if data is not None:
+            logger.info(f"載入 {len(data['coupons'])} 張優惠券（最後更新：{data['last_updated']}）")
+            return data["coupons"]
+
+    # 讀取上一輪的資料（用來比對差異）
+    previous = _load_parsed_data()
+
+    raw_coupons, fingerprint, reusable = _fetch_stage(previous)
+
+    if reusable is None:
+        # 原始資料完全沒變：沿用上次的解析結果，只更新時間
+        logger.info("原始資料沒有變動，沿用上次的解析結果")
+        parsed_coupons = previous["coupons"]
+    else:
+        parsed_coupons = _parse_stage(raw_coupons, reusable)
+
+    _persist_stage(parsed_coupons, fingerprint)
 
     return parsed_coupons
 
 
-def load_coupons_from_cache() -> Optional[List[Dict]]:
+# ========== 優惠券儲存（JSON / SQLite） ==========
+
+DB_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS coupons (
+    position INTEGER PRIMARY KEY,
+    id TEXT,
+    price INTEGER,
+    serves INTEGER,
+    data TEXT NOT NULL
+);
+-- 舊版本留下、沒有任何查詢用到的品項表與索引
+DROP TABLE IF EXISTS coupon_items;
+DROP INDEX IF EXISTS idx_coupons_id;
+DROP INDEX IF EXISTS idx_coupons_price;
+DROP INDEX IF EXISTS idx_coupons_serves;
+"""
+
+# 存在 meta 表的欄位
+CATALOG_META_FIELDS = ("last_updated", "count", "fingerprint", "schema_version")
+
+
+def _connect_db() -> sqlite3.Connection:
+    """開啟優惠券資料庫（必要時建立資料表）"""
+    os.makedirs(os.path.dirname(COUPON_DB_FILE) or ".", exist_ok=True)
+    conn = sqlite3.connect(COUPON_DB_FILE)
+    conn.executescript(DB_SCHEMA)
+    return conn
+
+
+def save_coupons_to_db(cache_data: Dict):
     """
-    從快取載入優惠券
+    將優惠券與 metadata 寫入 SQLite（單一 transaction，中途失敗會整批回滾）
+
+    參數：
+        cache_data: {"last_updated", "count", "fingerprint", "coupons"}
+    """
+    conn = _connect_db()
+    try:
+        with conn:
+            conn.execute("DELETE FROM coupons")
+            conn.execute("DELETE FROM meta")
+
+            for position, coupon in enumerate(cache_data["coupons"]):
+                conn.execute(
+                    "INSERT INTO coupons (position, id, price, serves, data) VALUES (?, ?, ?, ?, ?)",
+                    (
+                        position,
+                        coupon.get("id"),
+                        coupon.get("price"),
+                        coupon.get("serves"),
+                        json.dumps(coupon, ensure_ascii=False),
+                    )
+                )
+
+            conn.executemany(
+                "INSERT INTO meta (key, value) VALUES (?, ?)",
+                [(field, json.dumps(cache_data.get(field))) for field in CATALOG_META_FIELDS]
+            )
+    finally:
+        conn.close()
+
+    logger.info(f"已儲存解析結果：{COUPON_DB_FILE}")
+
+
+def load_coupons_from_db() -> Optional[Dict]:
+    """
+    從 SQLite 載入優惠券與 metadata
 
     回傳：
-        優惠券列表，若快取不存在則回傳 None
+        {"last_updated", "count", "fingerprint", "coupons"}，資料庫不存在或損壞則回傳 None
     """
-    if not os.path.exists(PARSED_DATA_FILE):
+    if not os.path.exists(COUPON_DB_FILE):
+        return None
+
+    try:
+        conn = _connect_db()
+        try:
+            data = _read_db_meta(conn)
+            rows = conn.execute("SELECT data FROM coupons ORDER BY position").fetchall()
+        finally:
+            conn.close()
+    except Exception as e:
+        logger.error(f"載入資料庫失敗：{e}")
         return None
 
+    data["coupons"] = [json.loads(row[0]) for row in rows]
+    return data
+
+
+def _read_db_meta(conn: sqlite3.Connection) -> Dict:
+    """讀取 meta 表"""
+    rows = conn.execute("SELECT key, value FROM meta").fetchall()
+    return {key: json.loads(value) for key, value in rows}
+
+
+def _migrate_json_to_db():
+    """SQLite 資料庫尚未建立、但有舊的 coupons.json 時，匯入一次"""
+    if os.path.exists(COUPON_DB_FILE) or not os.path.exists(PARSED_DATA_FILE):
+        return
+
     try:
         with open(PARSED_DATA_FILE, "r", encoding="utf-8") as f:
             data = json.load(f)
-        return data["coupons"]
+        logger.info(f"將 {PARSED_DATA_FILE} 匯入 {COUPON_DB_FILE}")
+        save_coupons_to_db(data)
+    except Exception as e:
+        logger.error(f"匯入舊快取失敗：{e}")
+
+
+def _catalog_store_file() -> str:
+    """目前儲存方式對應的資料檔路徑"""
+    return COUPON_DB_FILE if config.COUPON_STORE == "sqlite" else PARSED_DATA_FILE
+
+
+def _write_catalog_meta(meta: Dict):
+    """寫入 metadata sidecar（data/coupons.meta.json）"""
+    sidecar = {field: meta.get(field) for field in CATALOG_META_FIELDS}
+    sidecar["store"] = config.COUPON_STORE
+    write_json_atomic(CATALOG_META_FILE, sidecar)
+
+
+def save_catalog(cache_data: Dict):
+    """
+    依配置的儲存方式（COUPON_STORE）儲存解析結果，並更新 metadata sidecar
+
+    sidecar 在資料寫入完成後才更新，所以它記錄的一定是已落地的版本。
+
+    參數：
+        cache_data: {"last_updated", "count", "fingerprint", "schema_version", "coupons"}
+    """
+    if config.COUPON_STORE == "sqlite":
+        save_coupons_to_db(cache_data)
+    else:
+        write_json_atomic(PARSED_DATA_FILE, cache_data)
+        logger.info(f"已儲存解析結果：{PARSED_DATA_FILE}")
+
+    _write_catalog_meta(cache_data)
+
+
+def _load_parsed_data() -> Optional[Dict]:
+    """
+    載入完整的解析結果（包含 last_updated、fingerprint 等欄位）
+
+    回傳：
+        {"last_updated", "count", "fingerprint", "schema_version", "coupons"}，不存在或損壞則回傳 None
+    """
+    if config.COUPON_STORE == "sqlite":
+        _migrate_json_to_db()
+        return load_coupons_from_db()
+
+    if not os.path.exists(PARSED_DATA_FILE):
+        return None
+
+    try:
+        with open(PARSED_DATA_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
     except Exception as e:
-        logger.error(f"載入快取失敗：{e}")
+        logger.error(f"載入解析結果失敗：{e}")
+        return None
+
+
+def _load_catalog_meta_from_store() -> Optional[Dict]:
+    """從資料本體讀取 metadata（sidecar 不存在或過期時使用）"""
+    if config.COUPON_STORE == "sqlite":
+        _migrate_json_to_db()
+        if not os.path.exists(COUPON_DB_FILE):
+            return None
+        try:
+            conn = _connect_db()
+            try:
+                meta = _read_db_meta(conn)
+            finally:
+                conn.close()
+        except Exception as e:
+            logger.error(f"讀取資料庫 metadata 失敗：{e}")
+            return None
+        return meta or None
+
+    data = _load_parsed_data()
+    if data is None:
+        return None
+    data["count"] = len(data.get("coupons") or [])
+    return {field: data.get(field) for field in CATALOG_META_FIELDS}
+
+
+def load_catalog_meta() -> Optional[Dict]:
+    """
+    載入解析結果的 metadata（last_updated、count、fingerprint、schema_version）
+
+    優先讀取小型的 sidecar 檔案，不需要解析整份優惠券資料；
+    sidecar 不存在、格式版本不符或儲存方式不同時，才從資料本體讀取並補寫 sidecar。
+
+    回傳：
+        metadata dict，不存在或損壞則回傳 None
+    """
+    if os.path.exists(CATALOG_META_FILE) and os.path.exists(_catalog_store_file()):
+        try:
+            with open(CATALOG_META_FILE, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta.get("schema_version") == CATALOG_SCHEMA_VERSION \
+                    and meta.get("store") == config.COUPON_STORE:
+                return meta
+        except Exception as e:
+            logger.warning(f"讀取 metadata sidecar 失敗：{e}")
+
+    meta = _load_catalog_meta_from_store()
+    if meta is not None and meta.get("schema_version") == CATALOG_SCHEMA_VERSION:
+        try:
+            _write_catalog_meta(meta)
+        except Exception as e:
+            logger.warning(f"寫入 metadata sidecar 失敗：{e}")
+    return meta
+
+
+# 本 process 已載入的優惠券（資料檔沒有變動就不重新載入）
+_loaded_catalog = {"stamp": None, "coupons": None}
+_loaded_catalog_lock = threading.Lock()
+
+
+def _store_stamp():
+    """資料檔的 (路徑, mtime, 大小)，用來判斷是否需要重新載入"""
+    path = _catalog_store_file()
+    try:
+        stat = os.stat(path)
+    except OSError:
         return None
+    return path, stat.st_mtime_ns, stat.st_size
+
+
+def load_coupons_from_cache() -> Optional[List[Dict]]:
+    """
+    從快取載入優惠券
+
+    同一個 process 只會載入一次，資料檔更新後才會重新載入。
+
+    回傳：
+        優惠券列表，若快取不存在則回傳 None
+    """
+    with _loaded_catalog_lock:
+        stamp = _store_stamp()
+        if stamp is not None and stamp == _loaded_catalog["stamp"]:
+            return _loaded_catalog["coupons"]
+
+        data = _load_parsed_data()
+        if data is None:
+            return None
+
+        try:
+            coupons = data["coupons"]
+        except Exception as e:
+            logger.error(f"載入快取失敗：{e}")
+            return None
+
+        # 重新取 stamp（舊 coupons.json 可能剛被匯入 SQLite）
+        _loaded_catalog["stamp"] = _store_stamp()
+        _loaded_catalog["coupons"] = coupons
+        return coupons
 
 
 def should_update_coupons(max_age_hours: int = 24):
@@ -304,22 +1390,20 @@ def should_update_coupons(max_age_hours: int = 24):
     回傳：
         (need_update: bool, reason: str)
     """
-    cache_path = Path(PARSED_DATA_FILE)
-
-    # 檢查快取檔案是否存在
-    if not cache_path.exists():
-        return True, "沒有快取資料"
-
     try:
-        with open(cache_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        # 只讀取 metadata sidecar，不載入優惠券內容
+        meta = load_catalog_meta()
+
+        # 檢查快取是否存在
+        if meta is None:
+            return True, "沒有快取資料"
 
         # 檢查資料格式
-        if 'coupons' not in data or not data['coupons']:
+        if not meta.get("count"):
             return True, "快取資料損壞"
 
         # 檢查更新時間
-        last_updated = data.get("last_updated")
+        last_updated = meta.get("last_updated")
         if not last_updated:
             return True, "無法確認資料時間"
 
@@ -338,6 +1422,285 @@ def should_update_coupons(max_age_hours: int = 24):
         return True, f"檢查失敗：{e}"
 
 
+# ========== 優惠券圖片快取 ==========
+
+THUMBNAIL_DIR_NAME = "thumbs"
+# 記錄這個快取下載過的圖片檔名（清除過期圖片時只會動到這些檔案）
+IMAGE_MANIFEST_NAME = ".manifest.json"
+
+
+def image_name(coupon: Dict) -> Optional[str]:
+    """
+    取得優惠券圖片的檔名（作為本機快取的 key）
+
+    參數：
+        coupon: 優惠券資料（需有 img 欄位）
+
+    回傳：
+        圖片檔名，沒有圖片則回傳 None
+    """
+    url = coupon.get("img") or ""
+    name = os.path.basename(url.split("?")[0])
+    return name or None
+
+
+def get_local_image(coupon: Dict, thumbnail: bool = True) -> Optional[str]:
+    """
+    取得優惠券圖片的本機路徑
+
+    參數：
+        coupon: 優惠券資料
+        thumbnail: 優先使用縮圖
+
+    回傳：
+        本機圖片路徑，尚未下載則回傳 None
+    """
+    name = image_name(coupon)
+    if not name:
+        return None
+
+    candidates = []
+    if thumbnail:
+        candidates.append(os.path.join(config.COUPON_IMAGES_DIR, THUMBNAIL_DIR_NAME, name))
+    candidates.append(os.path.join(config.COUPON_IMAGES_DIR, name))
+
+    for path in candidates:
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def _make_thumbnail(source: str, target: str):
+    """產生縮圖（沒有 Pillow 時略過）"""
+    if Image is None:
+        return
+
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    tmp_path = target + ".tmp"
+    with Image.open(source) as img:
+        img.thumbnail((config.THUMBNAIL_SIZE, config.THUMBNAIL_SIZE))
+        img.save(tmp_path, format=img.format or "PNG")
+    os.replace(tmp_path, target)
+
+
+def _download_image(session: requests.Session, url: str, name: str) -> bool:
+    """
+    下載單張圖片並產生縮圖（已存在的檔案不重新下載）
+
+    回傳：
+        是否有新下載
+    """
+    path = os.path.join(config.COUPON_IMAGES_DIR, name)
+    thumb_path = os.path.join(config.COUPON_IMAGES_DIR, THUMBNAIL_DIR_NAME, name)
+    downloaded = False
+
+    if not os.path.exists(path):
+        response = session.get(url, headers={"user-agent": HEADERS["user-agent"]}, timeout=config.SCRAPER_TIMEOUT)
+        response.raise_for_status()
+
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(response.content)
+        os.replace(tmp_path, path)
+        downloaded = True
+
+    if not os.path.exists(thumb_path):
+        try:
+            _make_thumbnail(path, thumb_path)
+        except Exception as e:
+            logger.warning(f"產生縮圖失敗 ({name})：{e}")
+
+    return downloaded
+
+
+def _image_manifest_path() -> str:
+    return os.path.join(config.COUPON_IMAGES_DIR, IMAGE_MANIFEST_NAME)
+
+
+def _load_image_manifest() -> set:
+    """讀取已下載圖片的檔名清單（沒有或損壞時回傳空集合）"""
+    try:
+        with open(_image_manifest_path(), "r", encoding="utf-8") as f:
+            return set(json.load(f))
+    except (OSError, ValueError, TypeError):
+        return set()
+
+
+def _evict_stale_images(keep: set, managed: set) -> set:
+    """
+    刪除不屬於目前優惠券的圖片與縮圖
+
+    只刪除 manifest 記錄的檔案（由這個快取下載的），目錄中其他檔案不動；
+    keep 為空（例如爬取失敗拿到空列表）時不清除任何檔案。
+
+    參數：
+        keep: 目前優惠券的圖片檔名
+        managed: manifest 記錄的檔名
+
+    回傳：
+        清除後仍由快取管理的檔名
+    """
+    if not keep:
+        return managed
+
+    removed = 0
+    for name in managed - keep:
+        for directory in (config.COUPON_IMAGES_DIR, os.path.join(config.COUPON_IMAGES_DIR, THUMBNAIL_DIR_NAME)):
+            for path in (os.path.join(directory, name), os.path.join(directory, name + ".tmp")):
+                if os.path.isfile(path):
+                    os.remove(path)
+                    removed += 1
+
+    if removed:
+        logger.info(f"已清除 {removed} 個過期的圖片檔案")
+
+    return managed & keep
+
+
+def download_coupon_images(coupons: List[Dict], max_workers: Optional[int] = None) -> int:
+    """
+    同時下載所有優惠券圖片到 COUPON_IMAGES_DIR，產生縮圖並清除過期檔案
+
+    圖片以檔名為 key，已下載的不會重複下載；單張失敗只會記錄，不影響其他圖片。
+
+    參數：
+        coupons: 優惠券列表
+        max_workers: 同時下載數（預設用配置檔的 IMAGE_WORKERS）
+
+    回傳：
+        新下載的圖片數
+    """
+    targets = {}
+    for coupon in coupons:
+        name = image_name(coupon)
+        if name:
+            targets[name] = coupon["img"]
+
+    os.makedirs(config.COUPON_IMAGES_DIR, exist_ok=True)
+
+    if max_workers is None:
+        max_workers = config.IMAGE_WORKERS
+    max_workers = max(1, min(max_workers, len(targets) or 1))
+
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=max_workers))
+
+    downloaded = 0
+    failed = 0
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                executor.submit(_download_image, session, url, name): name
+                for name, url in targets.items()
+            }
+            for future in as_completed(futures):
+                try:
+                    if future.result():
+                        downloaded += 1
+                except Exception as e:
+                    failed += 1
+                    logger.warning(f"下載圖片失敗 ({futures[future]})：{e}")
+    finally:
+        session.close()
+
+    # 記錄下載成功的圖片，之後只清除 manifest 中的檔案
+    managed = _load_image_manifest() | {
+        name for name in targets if os.path.exists(os.path.join(config.COUPON_IMAGES_DIR, name))
+    }
+    managed = _evict_stale_images(set(targets), managed)
+    write_json_atomic(_image_manifest_path(), sorted(managed))
+    logger.info(f"圖片快取：新下載 {downloaded} 張，失敗 {failed} 張，共 {len(targets)} 張")
+
+    return downloaded
+
+
+# ========== 背景更新（stale-while-revalidate） ==========
+
+class Catalog:
+    """
+    目前使用中的優惠券資料
+
+    背景更新完成時整批替換並遞增版本號，使用端比對版本號決定是否重新載入。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = 0
+        self._coupons: Optional[List[Dict]] = None
+
+    def swap(self, coupons: List[Dict]) -> int:
+        """
+        替換優惠券資料
+
+        參數：
+            coupons: 新的優惠券列表
+
+        回傳：
+            新的版本號
+        """
+        with self._lock:
+            self._coupons = coupons
+            self._version += 1
+            return self._version
+
+    def get(self):
+        """
+        取得目前的版本號與優惠券資料
+
+        回傳：
+            (version, coupons)，尚未更新過時 coupons 為 None
+        """
+        with self._lock:
+            return self._version, self._coupons
+
+    @property
+    def version(self) -> int:
+        with self._lock:
+            return self._version
+
+
+# 全域優惠券資料（同一個 process 內的所有對話共用）
+catalog = Catalog()
+
+_refresh_lock = threading.Lock()
+_refresh_thread: Optional[threading.Thread] = None
+
+
+def refresh_catalog_in_background(on_done=None) -> threading.Thread:
+    """
+    在背景執行緒重新爬取與解析優惠券，完成後替換 catalog
+
+    已有背景更新在執行時不會重複啟動，直接回傳執行中的執行緒。
+    更新失敗時保留舊的快取與 catalog。
+
+    參數：
+        on_done: 完成時的回呼 on_done(version, coupons)（可選，在背景執行緒呼叫）
+
+    回傳：
+        執行更新的執行緒
+    """
+    global _refresh_thread
+
+    def run():
+        try:
+            coupons = scrape_and_parse(force_update=True)
+            version = catalog.swap(coupons)
+            logger.info(f"背景更新完成：{len(coupons)} 張優惠券（版本 {version}）")
+            if on_done:
+                on_done(version, coupons)
+        except Exception as e:
+            logger.error(f"背景更新失敗，繼續使用舊資料：{e}")
+
+    with _refresh_lock:
+        if _refresh_thread is not None and _refresh_thread.is_alive():
+            return _refresh_thread
+
+        _refresh_thread = threading.Thread(target=run, name="catalog-refresh", daemon=True)
+        _refresh_thread.start()
+        logger.info("已開始背景更新優惠券")
+        return _refresh_thread
+
+
 if __name__ == "__main__":
     # 測試爬蟲
     import logging
@@ -348,6 +1711,11 @@ if __name__ == "__main__":
     print("=" * 60)
     print()
 
+    # 測試 0: 規則解析回歸測試（不需要網路）
+    print("🧩 測試 0: 規則解析回歸測試")
+    check_rule_parser()
+    print()
+
     # 測試 1: 抓取原始資料
     print("📥 測試 1: 抓取原始資料")
     try:
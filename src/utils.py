@@ -3,102 +3,1195 @@
 工具函數：LLM 呼叫、輔助功能
 """
 
+import os
+import re
+import json
+import time
+import random
+import asyncio
+import hashlib
+import sqlite3
+import tempfile
+import threading
+import weakref
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import requests
 import logging
+from requests.adapters import HTTPAdapter
 from config.config import config
 
+# httpx 為選用套件：沒有安裝時非同步呼叫改在執行緒中跑同步的 LLMClient
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
 # 設定日誌
 logging.basicConfig(
     level=logging.DEBUG if config.DEBUG_MODE else logging.INFO,
     format='%(asctime)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
+# httpx 預設每個請求都記一行 INFO，太吵
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+
+# 支援的 endpoint（預設協商順序）
+ENDPOINTS = ("generate", "chat")
 
+# 代表「伺服器不支援這個 endpoint」的狀態碼（只有這些才改試另一個 endpoint）
+ENDPOINT_UNSUPPORTED_STATUS = (404, 405)
 
-def call_llm(prompt, model=None, temperature=0.7, max_tokens=500):
+# 各 API 位址協商出的 endpoint：{base_url: (endpoint, 協商時間)}
+_endpoint_cache = {}
+_endpoint_cache_lock = threading.Lock()
+
+
+class LRUCache:
     """
-    呼叫 Ollama API
+    有容量上限與有效時間的 LRU 快取（執行緒安全）
 
-    參數：
-        prompt: 要傳給 LLM 的提示詞
-        model: 使用的模型（預設用配置檔的）
-        temperature: 溫度參數（0.0-1.0，越高越隨機）
-        max_tokens: 最大回應長度
+    超過 maxsize 時淘汰最久沒用到的項目，超過 ttl 秒的項目視為過期；
+    指定 path 時同時寫入 SQLite 檔案，記憶體中沒有的項目會從檔案讀回（重啟後仍有效）。
+    """
 
-    回傳：
-        LLM 的回應文字，失敗則回傳 None
+    def __init__(self, maxsize=256, ttl=None, path=None):
+        """
+        初始化快取
+
+        參數：
+            maxsize: 記憶體中最多保留幾筆
+            ttl: 有效時間（秒），None 或 0 表示不過期
+            path: SQLite 檔案路徑（None 表示只存在記憶體）
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl or None
+        self._data = OrderedDict()  # {key: (value, expires_at)}
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+        self._db = self._open_db(path) if path else None
+
+    def _open_db(self, path):
+        dirname = os.path.dirname(path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        conn = sqlite3.connect(path, check_same_thread=False)
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)"
+        )
+        # 開啟時順便清掉過期的項目，避免檔案無限長大
+        conn.execute("DELETE FROM cache WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),))
+        conn.commit()
+        return conn
+
+    def get(self, key, default=None):
+        """
+        取得快取值（會更新為最近使用）
+
+        參數：
+            key: 快取鍵（字串）
+            default: 沒有或已過期時的回傳值
+
+        回傳：
+            快取值，沒有則回傳 default
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None and self._db is not None:
+                row = self._db.execute(
+                    "SELECT value, expires_at FROM cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row:
+                    entry = (json.loads(row[0]), row[1])
+                    self._data[key] = entry
+                    self._evict()
+
+            if entry is not None and entry[1] is not None and entry[1] <= now:
+                self._drop(key)
+                self._stats["expirations"] += 1
+                entry = None
+
+            if entry is None:
+                self._stats["misses"] += 1
+                return default
+
+            self._data.move_to_end(key)
+            self._stats["hits"] += 1
+            return entry[0]
+
+    def set(self, key, value):
+        """
+        寫入快取值（值需可序列化為 JSON 才能寫入磁碟）
+
+        參數：
+            key: 快取鍵（字串）
+            value: 快取值
+        """
+        expires_at = time.time() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            self._evict()
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(value, ensure_ascii=False), expires_at)
+                )
+                self._db.commit()
+
+    def delete(self, key):
+        """
+        移除一筆快取
+
+        參數：
+            key: 快取鍵（字串）
+        """
+        with self._lock:
+            self._drop(key)
+
+    def clear(self):
+        """清空快取（包含磁碟檔案）"""
+        with self._lock:
+            self._data.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM cache")
+                self._db.commit()
+
+    def stats(self):
+        """
+        快取統計
+
+        回傳：
+            {"size", "hits", "misses", "evictions", "expirations", "hit_rate"}
+        """
+        with self._lock:
+            stats = dict(self._stats, size=len(self._data))
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+    def _drop(self, key):
+        self._data.pop(key, None)
+        if self._db is not None:
+            self._db.execute("DELETE FROM cache WHERE key = ?", (key,))
+            self._db.commit()
+
+    def _evict(self):
+        # 只淘汰記憶體中的項目，磁碟上的仍可讀回
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self._stats["evictions"] += 1
+
+
+class SingleFlight:
+    """
+    合併同時進行的相同請求（single-flight）
+
+    同一個 key 同時有多個呼叫者時，只有第一個真的執行，其餘等待並共用它的結果（或例外）；
+    執行完成後 key 就釋放，之後的呼叫會重新執行。
+    """
+
+    class _Call:
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+            self.waiters = 0
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._stats = {"executed": 0, "shared": 0}
+
+    def do(self, key, fn):
+        """
+        執行 fn()，同一個 key 正在執行中時改為等待它的結果
+
+        參數：
+            key: 請求的鍵（可雜湊）
+            fn: 無參數的函數
+
+        回傳：
+            fn() 的結果
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self._stats["shared"] += 1
+                leader = False
+            else:
+                call = self._calls[key] = self._Call()
+                self._stats["executed"] += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+            if call.waiters:
+                logger.debug(f"single-flight：{call.waiters} 個相同請求共用同一次執行")
+
+    def stats(self):
+        """
+        回傳：
+            {"executed", "shared"}：實際執行次數 / 共用別人結果的次數
+        """
+        with self._lock:
+            return dict(self._stats)
+
+
+class AsyncSingleFlight:
+    """
+    SingleFlight 的 asyncio 版本：同一個事件迴圈內，相同 key 的協程只有第一個真的執行
+
+    每個事件迴圈各自記錄進行中的請求（asyncio.Future 不能跨迴圈等待）。
+    """
+
+    def __init__(self):
+        self._calls = weakref.WeakKeyDictionary()  # {loop: {key: asyncio.Future}}
+        self._lock = threading.Lock()
+        self._stats = {"executed": 0, "shared": 0}
+
+    async def do(self, key, fn):
+        """
+        執行 await fn()，同一個 key 正在執行中時改為等待它的結果
+
+        參數：
+            key: 請求的鍵（可雜湊）
+            fn: 無參數、回傳 awaitable 的函數
+
+        回傳：
+            fn() 的結果
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            calls = self._calls.setdefault(loop, {})
+            future = calls.get(key)
+            leader = future is None
+            if leader:
+                future = calls[key] = loop.create_future()
+                self._stats["executed"] += 1
+            else:
+                self._stats["shared"] += 1
+
+        if not leader:
+            # shield：等待者被取消時不影響其他人共用的結果
+            return await asyncio.shield(future)
+
+        try:
+            result = await fn()
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # 沒有等待者時避免「exception was never retrieved」警告
+            raise
+        finally:
+            with self._lock:
+                calls.pop(key, None)
+
+    def stats(self):
+        """
+        回傳：
+            {"executed", "shared"}：實際執行次數 / 共用別人結果的次數
+        """
+        with self._lock:
+            return dict(self._stats)
+
+
+class JSONObjectScanner:
+    """
+    逐段掃描串流輸出，找出最外層 JSON 物件結束的位置
+
+    以括號計數判斷，會略過字串內的括號與跳脫字元；第一個「{」之前的內容（例如 ```json）不影響判斷。
+    """
+
+    def __init__(self):
+        self.depth = 0
+        self.started = False
+        self.in_string = False
+        self.escaped = False
+        self.complete = False
+
+    def feed(self, chunk):
+        """
+        讀入一段輸出
+
+        參數：
+            chunk: 新收到的文字
+
+        回傳：
+            物件在這段文字中結束的位置（結束的「}」之後的索引），尚未結束則回傳 -1
+        """
+        if self.complete:
+            return 0
+
+        for i, ch in enumerate(chunk):
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif ch == "\\":
+                    self.escaped = True
+                elif ch == '"':
+                    self.in_string = False
+            elif ch == '"' and self.started:
+                self.in_string = True
+            elif ch == "{":
+                self.started = True
+                self.depth += 1
+            elif ch == "}" and self.started:
+                self.depth -= 1
+                if self.depth == 0:
+                    self.complete = True
+                    return i + 1
+        return -1
+
+
+class LLMAPIError(RuntimeError):
+    """LLM API 回傳錯誤狀態碼（status 為 HTTP 狀態碼）"""
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+    @property
+    def retryable(self):
+        """伺服器錯誤（5xx）或流量限制（429）才值得重試"""
+        return self.status is not None and (self.status >= 500 or self.status == 429)
+
+
+class LLMUnavailableError(RuntimeError):
+    """斷路器斷路中，呼叫直接失敗"""
+
+
+class CircuitBreaker:
+    """
+    斷路器：連續失敗太多次就暫停呼叫，避免伺服器掛掉時每個請求都等到超時
+
+    狀態：
+    - closed：正常呼叫
+    - open：連續失敗 threshold 次後進入，cooldown 秒內直接失敗
+    - half-open：冷卻結束後放行一個試探請求，成功就回到 closed，失敗就再次 open
+    """
+
+    def __init__(self, threshold=5, cooldown=30):
+        """
+        參數：
+            threshold: 連續失敗幾次後斷路（0 表示停用）
+            cooldown: 斷路後多久放行試探請求（秒）
+        """
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if time.monotonic() - self._opened_at >= self.cooldown:
+                return "half-open"
+            return "open"
+
+    def retry_after(self):
+        """斷路中時，距離可以試探還有幾秒"""
+        with self._lock:
+            if self._opened_at is None:
+                return 0.0
+            return max(self.cooldown - (time.monotonic() - self._opened_at), 0.0)
+
+    def allow(self):
+        """
+        這次呼叫是否放行
+
+        回傳：
+            bool: False 表示斷路中，應直接失敗
+        """
+        if self.threshold <= 0:
+            return True
+
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.cooldown or self._probing:
+                return False
+            # 冷卻結束：只放行一個試探請求
+            self._probing = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            if self._opened_at is not None:
+                logger.info("LLM 斷路器關閉（試探請求成功）")
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        if self.threshold <= 0:
+            return
+
+        with self._lock:
+            self._failures += 1
+            if self._probing or self._failures >= self.threshold:
+                if not self._probing:
+                    logger.warning(f"LLM 連續失敗 {self._failures} 次，斷路 {self.cooldown} 秒")
+                self._opened_at = time.monotonic()
+                self._probing = False
+
+
+# 可重試的錯誤（同步與非同步客戶端共用）
+TIMEOUT_ERRORS = (requests.exceptions.Timeout,) + ((httpx.TimeoutException,) if httpx else ())
+CONNECTION_ERRORS = (requests.exceptions.ConnectionError,) + ((httpx.TransportError,) if httpx else ())
+RETRYABLE_ERRORS = TIMEOUT_ERRORS + CONNECTION_ERRORS + (LLMAPIError,)
+
+
+class LLMClient:
+    """
+    Ollama API 客戶端
+
+    共用一個 requests.Session（連線池 + keep-alive），避免每次呼叫都重新做 TCP/TLS 握手，
+    並記錄每次請求的耗時（總時間、伺服器運算時間、網路與連線時間）。
     """
-    if model is None:
-        model = config.OLLAMA_MODEL
 
-    logger.debug(f"正在呼叫 LLM (model={model})...")
+    def __init__(self, base_url=None, api_key=None, pool_size=None, keep_alive=None, timeout=None):
+        """
+        初始化客戶端
 
-    headers = {
-        "Authorization": f"Bearer {config.OLLAMA_API_KEY}",
-        "Content-Type": "application/json"
-    }
+        參數：
+            base_url: API 位址（預設用配置檔的 OLLAMA_API_URL）
+            api_key: API 金鑰（預設用配置檔的 OLLAMA_API_KEY）
+            pool_size: 連線池大小（預設用配置檔的 LLM_POOL_SIZE）
+            keep_alive: 是否保持連線（預設用配置檔的 LLM_KEEP_ALIVE）
+            timeout: 請求超時秒數（預設用配置檔的 LLM_TIMEOUT）
+        """
+        self.base_url = base_url or config.OLLAMA_API_URL
+        self.api_key = api_key or config.OLLAMA_API_KEY
+        self.timeout = timeout or config.LLM_TIMEOUT
+        pool_size = pool_size or config.LLM_POOL_SIZE
+        keep_alive = config.LLM_KEEP_ALIVE if keep_alive is None else keep_alive
 
-    # 嘗試 /generate endpoint（老師的 API 格式）
-    data_generate = {
-        "model": model,
-        "prompt": prompt,
-        "stream": False,
-        "options": {
-            "temperature": temperature,
-            "num_predict": max_tokens
+        self.session = requests.Session()
+        self._adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", self._adapter)
+        self.session.mount("https://", self._adapter)
+        self.session.headers.update({
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json",
+            "Connection": "keep-alive" if keep_alive else "close",
+        })
+
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "requests": 0, "total": 0.0, "server": 0.0, "network": 0.0,
+            "retries": 0, "hedged": 0, "hedge_wins": 0, "rejected": 0,
         }
-    }
 
-    try:
-        # 先嘗試 /generate endpoint
-        response = requests.post(
-            f"{config.OLLAMA_API_URL}/generate",
-            headers=headers,
-            json=data_generate,
-            timeout=config.LLM_TIMEOUT
-        )
+        # 韌性：重試、斷路器、對沖請求（hedged request）
+        self.max_retries = config.LLM_MAX_RETRIES
+        self.retry_backoff = config.LLM_RETRY_BACKOFF
+        self.breaker = CircuitBreaker(config.LLM_BREAKER_THRESHOLD, config.LLM_BREAKER_COOLDOWN)
+        self.hedge = config.LLM_HEDGE
+        self._latencies = deque(maxlen=200)
+        self._hedge_executor = None
+
+    # ---------- 耗時統計 ----------
+
+    @property
+    def last_timing(self):
+        """
+        目前執行緒最近一次請求的耗時（秒）
+
+        回傳：
+            {"endpoint", "total", "server", "network", "ttft"}，尚未呼叫過則回傳 None
+            - total：從送出請求到讀完回應
+            - server：Ollama 回報的 total_duration（模型載入 + 推論）
+            - network：total - server（連線、TLS 握手、傳輸）
+            - ttft：串流模式下收到第一個 token 的時間（非串流為 None）
+        """
+        return getattr(self._local, "timing", None)
+
+    def timing_stats(self):
+        """
+        累計的耗時統計
+
+        回傳：
+            {"requests", "total", "server", "network", "retries", "hedged", "hedge_wins",
+             "rejected", "p95", "connections_opened"}
+            - retries：重試次數
+            - hedged / hedge_wins：送出對沖請求的次數 / 對沖請求先回來的次數
+            - rejected：斷路中直接失敗的次數
+            - p95：近期成功請求的 p95 延遲（樣本不足為 None）
+        """
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["p95"] = self._p95()
+        stats["connections_opened"] = self._connections_opened()
+        return stats
+
+    def _count(self, name):
+        with self._stats_lock:
+            self._stats[name] += 1
+
+    def _p95(self):
+        """近期成功請求的 p95 延遲（秒），樣本少於 LLM_HEDGE_MIN_SAMPLES 時回傳 None"""
+        latencies = sorted(self._latencies)
+        if len(latencies) < max(config.LLM_HEDGE_MIN_SAMPLES, 1):
+            return None
+        return latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)]
+
+    def _connections_opened(self):
+        """連線池實際建立過的連線數（可用來確認 keep-alive 是否生效）"""
+        try:
+            pools = self._adapter.poolmanager.pools
+            return sum(pools[key].num_connections for key in pools.keys())
+        except Exception:
+            return None
+
+    def _record_timing(self, endpoint, total, result, ttft=None):
+        server = (result.get("total_duration") or 0) / 1e9
+        timing = {
+            "endpoint": endpoint,
+            "total": total,
+            "server": server,
+            "network": max(total - server, 0.0) if server else None,
+            "ttft": ttft,
+        }
+        self._local.timing = timing
+
+        with self._stats_lock:
+            self._stats["requests"] += 1
+            self._stats["total"] += total
+            self._stats["server"] += server
+            self._stats["network"] += timing["network"] or 0.0
 
-        if response.status_code == 200:
-            result = response.json()
-            # Ollama /generate 的回應格式
-            content = result.get("response", "")
-            logger.debug(f"LLM 回應成功（/generate，長度={len(content)}）")
-            return content
+        logger.debug(
+            f"LLM 耗時（/{endpoint}）：總計 {total:.2f}s，伺服器 {server:.2f}s，"
+            f"網路/連線 {timing['network'] if timing['network'] is not None else float('nan'):.2f}s"
+        )
 
-        # 如果 /generate 失敗，嘗試 /chat endpoint
-        logger.warning(f"/generate 失敗 ({response.status_code})，嘗試 /chat")
+    # ---------- 請求 ----------
 
-        data_chat = {
+    def _build_payload(self, endpoint, prompt, model, temperature, max_tokens, stream=False, format=None, stop=None):
+        payload = {
             "model": model,
-            "messages": [{"role": "user", "content": prompt}],
-            "stream": False,
+            "stream": stream,
             "options": {
                 "temperature": temperature,
                 "num_predict": max_tokens
             }
         }
+        # 結構化輸出："json" 或 JSON Schema（dict）
+        if format:
+            payload["format"] = format
+        if stop:
+            payload["options"]["stop"] = list(stop)
+        if endpoint == "chat":
+            payload["messages"] = [{"role": "user", "content": prompt}]
+        else:
+            payload["prompt"] = prompt
+        return payload
 
-        response = requests.post(
-            f"{config.OLLAMA_API_URL}/chat",
-            headers=headers,
-            json=data_chat,
-            timeout=config.LLM_TIMEOUT
+    def _post(self, endpoint, payload, timeout=None):
+        start = time.perf_counter()
+        response = self.session.post(
+            f"{self.base_url}/{endpoint}",
+            json=payload,
+            timeout=timeout or self.timeout
         )
+        # 讀完內容才算完成
+        _ = response.content
+        return response, time.perf_counter() - start
 
-        if response.status_code == 200:
-            result = response.json()
+    @staticmethod
+    def _extract_content(endpoint, result):
+        if endpoint == "chat":
             # Ollama /chat 的回應格式
-            content = result.get("message", {}).get("content", "")
-            logger.debug(f"LLM 回應成功（/chat，長度={len(content)}）")
-            return content
-        else:
-            error_msg = f"API 錯誤 {response.status_code}: {response.text}"
-            logger.error(error_msg)
-            print(f"❌ {error_msg}")
+            return result.get("message", {}).get("content", "")
+        # Ollama /generate 的回應格式
+        return result.get("response", "")
+
+    # ---------- Endpoint 協商 ----------
+
+    def _endpoint_order(self):
+        """
+        決定這次要嘗試的 endpoint 順序
+
+        已協商過且未過期時直接使用記住的 endpoint；否則依預設順序（/generate → /chat）重新協商。
+        """
+        with _endpoint_cache_lock:
+            cached = _endpoint_cache.get(self.base_url)
+
+        if cached:
+            endpoint, checked_at = cached
+            if time.monotonic() - checked_at < config.LLM_ENDPOINT_REVALIDATE_SECONDS:
+                other = "generate" if endpoint == "chat" else "chat"
+                return [endpoint, other]
+
+        return list(ENDPOINTS)
+
+    def _remember_endpoint(self, endpoint):
+        """
+        記住這個 API 位址可用的 endpoint
+
+        只有真的協商過（第一次成功、過期後重新協商、或改用另一個 endpoint）才更新時間；
+        用記住的 endpoint 成功不算，否則流量不斷時永遠不會重新協商。
+        """
+        now = time.monotonic()
+        with _endpoint_cache_lock:
+            previous = _endpoint_cache.get(self.base_url)
+            if (previous is None or previous[0] != endpoint
+                    or now - previous[1] >= config.LLM_ENDPOINT_REVALIDATE_SECONDS):
+                _endpoint_cache[self.base_url] = (endpoint, now)
+
+        if previous is None or previous[0] != endpoint:
+            logger.info(f"LLM endpoint 協商結果：{self.base_url} 使用 /{endpoint}")
+
+    def forget_endpoint(self):
+        """清除協商結果（下次呼叫會重新協商）"""
+        with _endpoint_cache_lock:
+            _endpoint_cache.pop(self.base_url, None)
+
+    def generate(self, prompt, model=None, temperature=0.7, max_tokens=500, format=None, stop=None):
+        """
+        呼叫 Ollama API
+
+        第一次呼叫時依序嘗試 /generate 與 /chat，記住可用的 endpoint 後直接使用，
+        每 LLM_ENDPOINT_REVALIDATE_SECONDS 秒（或記住的 endpoint 失敗時）重新協商。
+
+        超時、連線失敗與 5xx/429 會以指數退避（加隨機抖動）重試，所有嘗試共用 LLM_TIMEOUT 的時間預算；
+        連續失敗太多次時斷路器會讓後續呼叫直接失敗。開啟 LLM_HEDGE 時，
+        請求超過近期 p95 延遲還沒回來就再送一份，取先回來的結果。
+
+        參數：
+            prompt: 要傳給 LLM 的提示詞
+            model: 使用的模型（預設用配置檔的）
+            temperature: 溫度參數（0.0-1.0，越高越隨機）
+            max_tokens: 最大回應長度
+            format: 結構化輸出格式（"json" 或 JSON Schema dict，None 表示不限制）
+            stop: 停止序列（產生到這些字串就停止）
+
+        回傳：
+            LLM 的回應文字，失敗則回傳 None
+        """
+        if model is None:
+            model = config.OLLAMA_MODEL
+
+        if not self._admit():
             return None
 
+        logger.debug(f"正在呼叫 LLM (model={model})...")
+
+        deadline = time.monotonic() + self.timeout
+        extra = {"format": format, "stop": stop}
+        attempt = 0
+
+        while True:
+            try:
+                content = self._request_maybe_hedged(prompt, model, temperature, max_tokens, deadline, extra)
+                self.breaker.record_success()
+                return content
+
+            except RETRYABLE_ERRORS as e:
+                delay = self._retry_delay(e, attempt, deadline)
+                if delay is not None:
+                    attempt += 1
+                    time.sleep(delay)
+                    continue
+                self._report_failure(e)
+                return None
+
+            except Exception as e:
+                self._report_failure(e)
+                return None
+
+    # ---------- 重試與斷路器（generate / stream / agenerate 共用） ----------
+
+    def _admit(self):
+        """
+        斷路器是否放行這次呼叫（不放行時記錄並印出原因）
+
+        回傳：
+            bool
+        """
+        if self.breaker.allow():
+            return True
+        self._count("rejected")
+        error_msg = f"LLM 暫時無法使用（連續失敗，{self.breaker.retry_after():.0f} 秒後再試）"
+        logger.error(error_msg)
+        print(f"❌ {error_msg}")
+        return False
+
+    def _retry_delay(self, error, attempt, deadline):
+        """
+        決定失敗後是否重試
+
+        超時、連線失敗與 5xx/429 以指數退避（full jitter）重試，最多 max_retries 次，且不超過時間預算。
+
+        回傳：
+            要等待的秒數，不重試則回傳 None
+        """
+        retryable = not isinstance(error, LLMAPIError) or error.retryable
+        delay = random.uniform(0, self.retry_backoff * (2 ** attempt))
+
+        if not retryable or attempt >= self.max_retries or time.monotonic() + delay >= deadline:
+            return None
+
+        self._count("retries")
+        logger.warning(f"LLM 呼叫失敗（{error}），{delay:.2f}s 後重試（第 {attempt + 1} 次）")
+        return delay
+
+    def _report_failure(self, error):
+        """記錄一次最終失敗（斷路器計數 + 日誌）"""
+        self.breaker.record_failure()
+        if isinstance(error, TIMEOUT_ERRORS):
+            error_msg = f"請求超時（{self.timeout}秒）"
+        elif isinstance(error, CONNECTION_ERRORS):
+            error_msg = f"連接失敗：{error}"
+        elif isinstance(error, LLMAPIError):
+            error_msg = str(error)
+        else:
+            error_msg = f"呼叫失敗: {error}"
+        logger.error(error_msg)
+        print(f"❌ {error_msg}")
+
+    def _request(self, prompt, model, temperature, max_tokens, deadline, extra):
+        """
+        送出一次請求（含 endpoint 協商），成功回傳回應文字
+
+        例外：
+            requests.exceptions.Timeout: 超過時間預算
+            requests.exceptions.RequestException: 連線失敗
+            LLMAPIError: 所有 endpoint 都回傳錯誤
+        """
+        order = self._endpoint_order()
+
+        for attempt, endpoint in enumerate(order):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise requests.exceptions.Timeout("超過 LLM_TIMEOUT 時間預算")
+
+            response, elapsed = self._post(
+                endpoint, self._build_payload(endpoint, prompt, model, temperature, max_tokens, **extra),
+                timeout=remaining
+            )
+
+            if response.status_code == 200:
+                result = response.json()
+                self._record_timing(endpoint, elapsed, result)
+                self._latencies.append(elapsed)
+                self._remember_endpoint(endpoint)
+                content = self._extract_content(endpoint, result)
+                logger.debug(f"LLM 回應成功（/{endpoint}，長度={len(content)}）")
+                return content
+
+            # 伺服器錯誤或流量限制：endpoint 本身沒問題，直接拋出（保留協商結果，交給重試）
+            if response.status_code not in ENDPOINT_UNSUPPORTED_STATUS:
+                raise LLMAPIError(f"API 錯誤 {response.status_code}: {response.text}", status=response.status_code)
+
+            # 這個 endpoint 不支援，改試另一個
+            if attempt + 1 < len(order):
+                logger.warning(f"/{endpoint} 失敗 ({response.status_code})，嘗試 /{order[attempt + 1]}")
+
+        self.forget_endpoint()
+        raise LLMAPIError(f"API 錯誤 {response.status_code}: {response.text}", status=response.status_code)
+
+    def _request_maybe_hedged(self, prompt, model, temperature, max_tokens, deadline, extra):
+        """
+        送出請求；開啟對沖且已有足夠的延遲樣本時，超過 p95 還沒回來就再送一份
+
+        回傳先成功的結果；兩份都失敗時拋出後失敗的例外。
+        """
+        p95 = self._p95() if self.hedge else None
+        if p95 is None:
+            return self._request(prompt, model, temperature, max_tokens, deadline, extra)
+
+        def run():
+            content = self._request(prompt, model, temperature, max_tokens, deadline, extra)
+            # 耗時記在工作執行緒，一起帶回呼叫端
+            return content, self.last_timing
+
+        executor = self._get_hedge_executor()
+        primary = executor.submit(run)
+        done, _ = wait([primary], timeout=p95)
+
+        pending = {primary}
+        if not done:
+            self._count("hedged")
+            logger.debug(f"LLM 請求超過 p95（{p95:.2f}s），送出對沖請求")
+            pending.add(executor.submit(run))
+
+        error = None
+        while pending:
+            done, pending = wait(pending, timeout=max(deadline - time.monotonic(), 0), return_when=FIRST_COMPLETED)
+            if not done:
+                raise requests.exceptions.Timeout("超過 LLM_TIMEOUT 時間預算")
+            for future in done:
+                if future.exception() is not None:
+                    error = future.exception()
+                    continue
+                # 另一份請求讓它在背景跑完，結果直接丟棄
+                content, timing = future.result()
+                self._local.timing = timing
+                if future is not primary:
+                    self._count("hedge_wins")
+                return content
+        raise error
+
+    def _get_hedge_executor(self):
+        with self._stats_lock:
+            if self._hedge_executor is None:
+                self._hedge_executor = ThreadPoolExecutor(
+                    max_workers=config.LLM_POOL_SIZE, thread_name_prefix="llm-hedge"
+                )
+            return self._hedge_executor
+
+    def stream(self, prompt, model=None, temperature=0.7, max_tokens=500, format=None, stop=None,
+               until_json_complete=False):
+        """
+        以串流模式呼叫 Ollama API，逐段產出回應文字
+
+        讀取 Ollama 的 NDJSON 串流，每收到一段就 yield；endpoint 協商方式與 generate 相同。
+        完成後可從 last_timing 取得 ttft（首個 token 時間）。
+
+        參數：
+            prompt: 要傳給 LLM 的提示詞
+            model: 使用的模型（預設用配置檔的）
+            temperature: 溫度參數（0.0-1.0，越高越隨機）
+            max_tokens: 最大回應長度
+            format: 結構化輸出格式（"json" 或 JSON Schema dict）
+            stop: 停止序列
+            until_json_complete: 最外層 JSON 物件一結束就中斷連線（不等模型產生多餘的內容）
+
+        產出：
+            回應文字片段
+
+        超時、連線失敗與 5xx/429 在收到首個 token 之前會重試（與 generate 共用重試次數、時間預算與斷路器）。
+
+        例外：
+            requests.exceptions.RequestException: 連線失敗或超時
+            LLMAPIError: API 回傳錯誤狀態碼
+            LLMUnavailableError: 斷路器斷路中
+        """
+        if model is None:
+            model = config.OLLAMA_MODEL
+
+        if not self._admit():
+            raise LLMUnavailableError(f"LLM 暫時無法使用（{self.breaker.retry_after():.0f} 秒後再試）")
+
+        logger.debug(f"正在以串流模式呼叫 LLM (model={model})...")
+
+        deadline = time.monotonic() + self.timeout
+        extra = {"format": format, "stop": stop, "until_json_complete": until_json_complete}
+        attempt = 0
+
+        while True:
+            received = False
+            try:
+                for chunk in self._stream_once(prompt, model, temperature, max_tokens, deadline, extra):
+                    received = True
+                    yield chunk
+                self.breaker.record_success()
+                return
+
+            except GeneratorExit:
+                # 呼叫端提前結束：有收到內容就代表伺服器正常
+                if received:
+                    self.breaker.record_success()
+                raise
+
+            except RETRYABLE_ERRORS as e:
+                # 已經送出的片段無法收回，只有在首個 token 之前失敗才重試
+                delay = None if received else self._retry_delay(e, attempt, deadline)
+                if delay is not None:
+                    attempt += 1
+                    time.sleep(delay)
+                    continue
+                self.breaker.record_failure()
+                raise
+
+            except Exception:
+                self.breaker.record_failure()
+                raise
+
+    def _stream_once(self, prompt, model, temperature, max_tokens, deadline, extra):
+        """送出一次串流請求（含 endpoint 協商），逐段產出回應文字"""
+        until_json_complete = extra["until_json_complete"]
+        order = self._endpoint_order()
+
+        for attempt, endpoint in enumerate(order):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise requests.exceptions.Timeout("超過 LLM_TIMEOUT 時間預算")
+
+            start = time.perf_counter()
+            response = self.session.post(
+                f"{self.base_url}/{endpoint}",
+                json=self._build_payload(
+                    endpoint, prompt, model, temperature, max_tokens, stream=True,
+                    format=extra["format"], stop=extra["stop"]
+                ),
+                timeout=remaining,
+                stream=True
+            )
+
+            if response.status_code != 200:
+                status, text = response.status_code, response.text
+                response.close()
+                if status not in ENDPOINT_UNSUPPORTED_STATUS:
+                    raise LLMAPIError(f"API 錯誤 {status}: {text}", status=status)
+                if attempt + 1 < len(order):
+                    logger.warning(f"/{endpoint} 失敗 ({status})，嘗試 /{order[attempt + 1]}")
+                continue
+
+            self._remember_endpoint(endpoint)
+            scanner = JSONObjectScanner() if until_json_complete else None
+            ttft = None
+            final = {}
+            try:
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    chunk = json.loads(line)
+                    if chunk.get("error"):
+                        raise RuntimeError(f"API 錯誤：{chunk['error']}")
+
+                    content = self._extract_content(endpoint, chunk)
+                    end = scanner.feed(content) if scanner and content else -1
+                    if end >= 0:
+                        content = content[:end]
+
+                    if content:
+                        if ttft is None:
+                            ttft = time.perf_counter() - start
+                        yield content
+
+                    if end >= 0:
+                        # JSON 已完整：關閉連線，伺服器會停止產生
+                        logger.debug("JSON 物件已完整，提前結束串流")
+                        break
+
+                    if chunk.get("done"):
+                        final = chunk
+                        break
+            finally:
+                response.close()
+
+            self._record_timing(endpoint, time.perf_counter() - start, final, ttft=ttft)
+            return
+
+        self.forget_endpoint()
+        raise LLMAPIError(f"API 錯誤 {status}: {text}", status=status)
+
+    def close(self):
+        """關閉連線池"""
+        if self._hedge_executor is not None:
+            self._hedge_executor.shutdown(wait=False)
+        self.session.close()
+
+
+_default_client = None
+_default_client_lock = threading.Lock()
+
+
+def get_llm_client():
+    """
+    取得共用的 LLMClient（API 位址或金鑰改變時會重新建立）
+
+    回傳：
+        LLMClient
+    """
+    global _default_client
+
+    with _default_client_lock:
+        client = _default_client
+        if client is None or client.base_url != config.OLLAMA_API_URL \
+                or client.api_key != config.OLLAMA_API_KEY:
+            if client is not None:
+                client.close()
+            client = LLMClient()
+            _default_client = client
+        return client
+
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """
+    取得共用的 LLM 回應快取（依 LLM_CACHE_SIZE / LLM_CACHE_TTL / LLM_CACHE_FILE 建立）
+
+    回傳：
+        LRUCache，LLM_CACHE_SIZE 為 0 時回傳 None
+    """
+    global _response_cache
+
+    if config.LLM_CACHE_SIZE <= 0:
+        return None
+
+    with _response_cache_lock:
+        if _response_cache is None:
+            _response_cache = LRUCache(
+                maxsize=config.LLM_CACHE_SIZE,
+                ttl=config.LLM_CACHE_TTL,
+                path=config.LLM_CACHE_FILE or None
+            )
+        return _response_cache
+
+
+def llm_cache_key(prompt, model, temperature, max_tokens, format=None, stop=None):
+    """
+    LLM 回應快取的鍵（模型、API 位址、prompt、溫度、最大長度、輸出格式、停止序列都相同才算同一個請求）
+
+    回傳：
+        SHA-256 十六進位字串
+    """
+    raw = json.dumps(
+        [model, config.OLLAMA_API_URL, prompt, temperature, max_tokens, format, list(stop or [])],
+        ensure_ascii=False, sort_keys=True
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def discard_llm_response(prompt, model=None, temperature=0.7, max_tokens=500, format=None, stop=None):
+    """
+    從快取移除某個請求的回應（例如回應格式錯誤，不希望下次再拿到同樣的結果）
+
+    參數同 call_llm
+    """
+    cache = get_response_cache()
+    if cache is not None:
+        cache.delete(llm_cache_key(prompt, model or config.OLLAMA_MODEL, temperature, max_tokens, format, stop))
+
+
+# 合併同時進行的相同 LLM 請求（執行緒 / 協程）
+llm_flight = SingleFlight()
+async_llm_flight = AsyncSingleFlight()
+
+
+def call_llm(prompt, model=None, temperature=0.7, max_tokens=500, use_cache=True, format=None, stop=None):
+    """
+    呼叫 Ollama API（使用共用的 LLMClient 連線池）
+
+    相同的請求會直接回傳快取的回應（見 LLM_CACHE_* 設定），失敗的回應不會被快取；
+    同時進行中的相同請求只會送出一次，其餘呼叫者共用結果。
+
+    參數：
+        prompt: 要傳給 LLM 的提示詞
+        model: 使用的模型（預設用配置檔的）
+        temperature: 溫度參數（0.0-1.0，越高越隨機）
+        max_tokens: 最大回應長度
+        use_cache: 是否使用回應快取
+        format: 結構化輸出格式（"json" 或 JSON Schema dict）
+        stop: 停止序列
+
+    回傳：
+        LLM 的回應文字，失敗則回傳 None
+    """
+    model = model or config.OLLAMA_MODEL
+    cache = get_response_cache() if use_cache else None
+    key = llm_cache_key(prompt, model, temperature, max_tokens, format, stop)
+
+    if cache is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            logger.debug(f"LLM 回應快取命中（長度={len(cached)}）")
+            return cached
+
+    def request():
+        content = get_llm_client().generate(
+            prompt, model=model, temperature=temperature, max_tokens=max_tokens, format=format, stop=stop
+        )
+        if cache is not None and content is not None:
+            cache.set(key, content)
+        return content
+
+    # 同時有相同的請求在跑時，等它的結果而不是再送一次
+    return llm_flight.do((key, use_cache), request)
+
+
+def call_llm_stream(prompt, model=None, temperature=0.7, max_tokens=500, on_token=None,
+                    format=None, stop=None, until_json_complete=False, use_cache=True):
+    """
+    以串流模式呼叫 Ollama API（使用共用的 LLMClient 連線池）
+
+    每收到一段回應就呼叫 on_token，全部收完後回傳完整文字；
+    錯誤處理與 call_llm 相同（失敗回傳 None）。
+
+    回應快取與 call_llm 共用：命中時把整段回應一次交給 on_token。
+    同時進行的相同串流請求不合併——每個呼叫者都需要即時收到自己的片段，
+    等待別人的串流只能在結束後拿到整段，就失去串流的意義。
+
+    參數：
+        prompt: 要傳給 LLM 的提示詞
+        model: 使用的模型（預設用配置檔的）
+        temperature: 溫度參數（0.0-1.0，越高越隨機）
+        max_tokens: 最大回應長度
+        on_token: 收到回應片段時的回呼 on_token(chunk)
+        format: 結構化輸出格式（"json" 或 JSON Schema dict）
+        stop: 停止序列
+        until_json_complete: 最外層 JSON 物件一結束就停止產生（快取的是到 JSON 結束為止的內容）
+        use_cache: 是否使用回應快取
+
+    回傳：
+        LLM 的完整回應文字，失敗則回傳 None
+    """
+    model = model or config.OLLAMA_MODEL
+    cache = get_response_cache() if use_cache else None
+    key = llm_cache_key(prompt, model, temperature, max_tokens, format, stop) if cache is not None else None
+
+    if cache is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            logger.debug(f"LLM 回應快取命中（長度={len(cached)}）")
+            if on_token:
+                on_token(cached)
+            return cached
+
+    client = get_llm_client()
+    chunks = []
+
+    try:
+        for chunk in client.stream(prompt, model=model, temperature=temperature, max_tokens=max_tokens,
+                                   format=format, stop=stop, until_json_complete=until_json_complete):
+            chunks.append(chunk)
+            if on_token:
+                on_token(chunk)
+
+    except LLMUnavailableError:
+        # 斷路中（_admit 已記錄原因）
+        return None
+
     except requests.exceptions.Timeout:
-        error_msg = f"請求超時（{config.LLM_TIMEOUT}秒）"
+        error_msg = f"請求超時（{client.timeout}秒）"
         logger.error(error_msg)
         print(f"❌ {error_msg}")
         return None
@@ -115,6 +1208,312 @@ def call_llm(prompt, model=None, temperature=0.7, max_tokens=500):
         print(f"❌ {error_msg}")
         return None
 
+    content = "".join(chunks)
+    timing = client.last_timing or {}
+    if timing.get("ttft") is not None:
+        logger.debug(f"LLM 串流完成（長度={len(content)}，首個 token {timing['ttft']:.2f}s）")
+    if cache is not None:
+        cache.set(key, content)
+    return content
+
+
+class AsyncLLMClient(LLMClient):
+    """
+    非同步的 Ollama API 客戶端
+
+    有安裝 httpx 時使用 httpx.AsyncClient（連線池 + keep-alive），等待 LLM 時不會卡住事件迴圈，
+    一個 worker 就能同時處理大量對話；沒有安裝時改用 asyncio.to_thread 呼叫同步的 generate。
+    endpoint 協商結果與同步客戶端共用。
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._pool_size = kwargs.get("pool_size") or config.LLM_POOL_SIZE
+        # 每個事件迴圈各自一個 httpx client：{loop: (client, closer)}
+        self._http_clients = weakref.WeakKeyDictionary()
+        self._http_lock = threading.Lock()
+
+    def _connections_opened(self):
+        # httpx 沒有公開連線池的統計
+        return super()._connections_opened() if httpx is None else None
+
+    async def _http(self):
+        """
+        取得目前事件迴圈的 httpx.AsyncClient（httpx 的連線綁定建立時的事件迴圈）
+
+        每個事件迴圈各自有一個 client，不同執行緒上的事件迴圈互不影響；
+        事件迴圈結束時（asyncio.run 會呼叫 shutdown_asyncgens）自動關閉它的 client。
+        """
+        loop = asyncio.get_running_loop()
+        with self._http_lock:
+            entry = self._http_clients.get(loop)
+        if entry is not None:
+            return entry[0]
+
+        client = httpx.AsyncClient(
+            headers=dict(self.session.headers),
+            timeout=self.timeout,
+            limits=httpx.Limits(
+                max_connections=self._pool_size,
+                max_keepalive_connections=self._pool_size
+            )
+        )
+        closer = self._close_on_loop_shutdown(loop, client)
+        await closer.__anext__()
+        with self._http_lock:
+            self._http_clients[loop] = (client, closer)
+        return client
+
+    async def _close_on_loop_shutdown(self, loop, client):
+        """停在 yield 的 async generator：事件迴圈結束或明確關閉時執行 finally，關閉 client"""
+        try:
+            yield
+        finally:
+            with self._http_lock:
+                entry = self._http_clients.get(loop)
+                if entry is not None and entry[0] is client:
+                    del self._http_clients[loop]
+            await client.aclose()
+
+    async def _close_http_client(self):
+        """關閉目前事件迴圈的 httpx.AsyncClient（其他事件迴圈的 client 不受影響）"""
+        with self._http_lock:
+            entry = self._http_clients.get(asyncio.get_running_loop())
+        if entry is not None:
+            await entry[1].aclose()
+
+    async def agenerate(self, prompt, model=None, temperature=0.7, max_tokens=500, format=None, stop=None):
+        """
+        非同步呼叫 Ollama API（endpoint 協商、重試與斷路器都與 generate 相同，不支援對沖）
+
+        參數：
+            prompt: 要傳給 LLM 的提示詞
+            model: 使用的模型（預設用配置檔的）
+            temperature: 溫度參數（0.0-1.0，越高越隨機）
+            max_tokens: 最大回應長度
+            format: 結構化輸出格式（"json" 或 JSON Schema dict）
+            stop: 停止序列
+
+        回傳：
+            LLM 的回應文字，失敗則回傳 None
+        """
+        if httpx is None:
+            return await asyncio.to_thread(
+                self.generate, prompt, model=model, temperature=temperature, max_tokens=max_tokens,
+                format=format, stop=stop
+            )
+
+        if model is None:
+            model = config.OLLAMA_MODEL
+
+        if not self._admit():
+            return None
+
+        logger.debug(f"正在非同步呼叫 LLM (model={model})...")
+
+        deadline = time.monotonic() + self.timeout
+        extra = {"format": format, "stop": stop}
+        attempt = 0
+
+        while True:
+            try:
+                content = await self._arequest(prompt, model, temperature, max_tokens, deadline, extra)
+                self.breaker.record_success()
+                return content
+
+            except RETRYABLE_ERRORS as e:
+                delay = self._retry_delay(e, attempt, deadline)
+                if delay is not None:
+                    attempt += 1
+                    await asyncio.sleep(delay)
+                    continue
+                self._report_failure(e)
+                return None
+
+            except Exception as e:
+                self._report_failure(e)
+                return None
+
+    async def _arequest(self, prompt, model, temperature, max_tokens, deadline, extra):
+        """
+        非同步送出一次請求（含 endpoint 協商），成功回傳回應文字
+
+        例外：
+            httpx.TimeoutException: 超過時間預算
+            httpx.TransportError: 連線失敗
+            LLMAPIError: API 回傳錯誤狀態碼
+        """
+        client = await self._http()
+        order = self._endpoint_order()
+
+        for attempt, endpoint in enumerate(order):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise httpx.TimeoutException("超過 LLM_TIMEOUT 時間預算")
+
+            start = time.perf_counter()
+            response = await client.post(
+                f"{self.base_url}/{endpoint}",
+                json=self._build_payload(endpoint, prompt, model, temperature, max_tokens, **extra),
+                timeout=remaining
+            )
+            elapsed = time.perf_counter() - start
+
+            if response.status_code == 200:
+                result = response.json()
+                self._record_timing(endpoint, elapsed, result)
+                self._latencies.append(elapsed)
+                self._remember_endpoint(endpoint)
+                content = self._extract_content(endpoint, result)
+                logger.debug(f"LLM 回應成功（/{endpoint}，長度={len(content)}）")
+                return content
+
+            # 伺服器錯誤或流量限制：endpoint 本身沒問題，直接拋出（保留協商結果，交給重試）
+            if response.status_code not in ENDPOINT_UNSUPPORTED_STATUS:
+                raise LLMAPIError(f"API 錯誤 {response.status_code}: {response.text}", status=response.status_code)
+
+            # 這個 endpoint 不支援，改試另一個
+            if attempt + 1 < len(order):
+                logger.warning(f"/{endpoint} 失敗 ({response.status_code})，嘗試 /{order[attempt + 1]}")
+
+        self.forget_endpoint()
+        raise LLMAPIError(f"API 錯誤 {response.status_code}: {response.text}", status=response.status_code)
+
+    async def aclose(self):
+        """關閉目前事件迴圈的非同步連線池與同步連線池"""
+        await self._close_http_client()
+        self.close()
+
+
+_async_client = None
+
+
+def get_async_llm_client():
+    """
+    取得共用的 AsyncLLMClient（API 位址或金鑰改變時會重新建立）
+
+    回傳：
+        AsyncLLMClient
+    """
+    global _async_client
+
+    with _default_client_lock:
+        client = _async_client
+        if client is None or client.base_url != config.OLLAMA_API_URL \
+                or client.api_key != config.OLLAMA_API_KEY:
+            client = AsyncLLMClient()
+            _async_client = client
+        return client
+
+
+async def acall_llm(prompt, model=None, temperature=0.7, max_tokens=500, use_cache=True, format=None, stop=None):
+    """
+    非同步呼叫 Ollama API（使用共用的 AsyncLLMClient，回應快取與 call_llm 共用）
+
+    同一個事件迴圈內同時進行的相同請求只會送出一次，其餘協程共用結果。
+
+    參數：
+        prompt: 要傳給 LLM 的提示詞
+        model: 使用的模型（預設用配置檔的）
+        temperature: 溫度參數（0.0-1.0，越高越隨機）
+        max_tokens: 最大回應長度
+        use_cache: 是否使用回應快取
+        format: 結構化輸出格式（"json" 或 JSON Schema dict）
+        stop: 停止序列
+
+    回傳：
+        LLM 的回應文字，失敗則回傳 None
+    """
+    model = model or config.OLLAMA_MODEL
+    cache = get_response_cache() if use_cache else None
+    key = llm_cache_key(prompt, model, temperature, max_tokens, format, stop)
+
+    if cache is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            logger.debug(f"LLM 回應快取命中（長度={len(cached)}）")
+            return cached
+
+    async def request():
+        content = await get_async_llm_client().agenerate(
+            prompt, model=model, temperature=temperature, max_tokens=max_tokens, format=format, stop=stop
+        )
+        if cache is not None and content is not None:
+            cache.set(key, content)
+        return content
+
+    # 同一個事件迴圈內有相同的請求在跑時，等它的結果而不是再送一次
+    return await async_llm_flight.do((key, use_cache), request)
+
+
+def estimate_tokens(text):
+    """
+    粗估文字的 token 數（不需要 tokenizer）
+
+    中日韓文字每字約 1 個 token，其餘字元約每 4 個字元 1 個 token。
+    只用於比較不同 Prompt 的相對成本，不是精確值。
+
+    參數：
+        text: 要估算的文字
+
+    回傳：
+        估算的 token 數
+    """
+    if not text:
+        return 0
+
+    cjk = sum(1 for ch in text if ord(ch) >= 0x2E80)
+    others = len(text) - cjk
+    return cjk + (others + 3) // 4
+
+
+def normalize_item(item):
+    """
+    清理品項名稱中的數量、尺寸等資訊
+
+    例如「咔啦雞腿堡x1」→「咔啦雞腿堡」、「上校雞塊4塊」→「上校雞塊」
+
+    參數：
+        item: 原始品項名稱
+
+    回傳：
+        清理後的品項名稱（可能為空字串）
+    """
+    cleaned = item
+    cleaned = re.sub(r'x\d+$', '', cleaned)  # 移除後綴 x1, x2 等
+    cleaned = re.sub(r'\(.*?\)', '', cleaned)  # 移除括號內容
+    cleaned = re.sub(r'\d+塊', '', cleaned)  # 移除數字+塊
+    cleaned = re.sub(r'^\d+', '', cleaned)  # 移除其他數字前綴
+    cleaned = cleaned.replace('?', '')  # 移除問號（編碼問題）
+    return cleaned.strip()
+
+
+def write_json_atomic(path, data):
+    """
+    以原子方式寫入 JSON 檔案
+
+    先寫到同一目錄下的暫存檔並 fsync，再用 os.replace 取代目標檔案；
+    寫到一半當掉時，舊檔案保持完整。
+
+    參數：
+        path: 目標檔案路徑
+        data: 要寫入的資料
+    """
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=".json")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
 
 def test_connection():
     """
@@ -130,11 +1529,16 @@ def test_connection():
     # 簡單的測試 prompt
     test_prompt = "請只回答「OK」，不要其他文字。"
 
-    response = call_llm(test_prompt, temperature=0.1, max_tokens=10)
+    # 測試連線不使用回應快取，確保真的打到伺服器
+    response = call_llm(test_prompt, temperature=0.1, max_tokens=10, use_cache=False)
 
     if response:
         print(f"✅ 連接成功！")
         print(f"   LLM 回應: {response.strip()}")
+        timing = get_llm_client().last_timing
+        if timing:
+            network = f"{timing['network']:.2f}s" if timing["network"] is not None else "未知"
+            print(f"   耗時: {timing['total']:.2f}s（伺服器 {timing['server']:.2f}s，網路/連線 {network}）")
         logger.info("LLM 連接測試通過")
         return True
     else: